@@ -0,0 +1,131 @@
+"""
+Шторм логинов: задержка лёгкой ручки (GET /) пока идут сотни POST /auth/token.
+
+Сравниваются два режима:
+  inline — bcrypt прямо в обработчике, как было раньше;
+  pool   — bcrypt в utils.passwords (ограниченный пул потоков).
+
+Запуск из папки back:
+    python -m bench.bench_login --logins 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+_db_path = os.path.join(tempfile.mkdtemp(), "bench_login.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_db_path}")
+
+import httpx  # noqa: E402
+from datetime import datetime  # noqa: E402
+
+from db.db import database, engine, metadata  # noqa: E402
+from db.models import users  # noqa: E402
+from main import app  # noqa: E402
+from utils import passwords  # noqa: E402
+
+EMAIL = "bench@example.com"
+PASSWORD = "bench-password"
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+async def _inline_run(fn, *args):
+    """Старое поведение: считаем bcrypt прямо в event loop"""
+    return fn(*args)
+
+
+async def probe(client, stop: asyncio.Event, samples: list, interval: float):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get("/")
+        samples.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+
+
+async def storm(client, logins: int, concurrency: int) -> tuple[float, int]:
+    gate = asyncio.Semaphore(concurrency)
+    failed = 0
+
+    async def one():
+        nonlocal failed
+        async with gate:
+            resp = await client.post("/auth/token", data={"username": EMAIL, "password": PASSWORD})
+            if resp.status_code != 200:
+                failed += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(logins)))
+    return time.perf_counter() - started, failed
+
+
+async def run_mode(client, mode: str, logins: int, concurrency: int, interval: float):
+    if mode == "inline":
+        passwords.password_pool.run = _inline_run
+    else:
+        vars(passwords.password_pool).pop("run", None)
+
+    idle = []
+    stop = asyncio.Event()
+    task = asyncio.create_task(probe(client, stop, idle, interval))
+    await asyncio.sleep(0.5)
+    stop.set()
+    await task
+
+    busy = []
+    stop = asyncio.Event()
+    task = asyncio.create_task(probe(client, stop, busy, interval))
+    elapsed, failed = await storm(client, logins, concurrency)
+    stop.set()
+    await task
+
+    print(f"{mode:>6}: {logins / elapsed:7.1f} logins/s ({elapsed:.2f}s, failed {failed})")
+    for label, samples in (("idle", idle), ("storm", busy)):
+        print(
+            f"        GET / {label:<5} n={len(samples):<4} "
+            f"p50={statistics.median(samples):7.1f}ms "
+            f"p95={percentile(samples, 95):7.1f}ms "
+            f"max={max(samples):7.1f}ms"
+        )
+
+
+async def main(args):
+    await database.connect()
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    await database.execute(users.delete().where(users.c.email == EMAIL))
+    await database.execute(users.insert().values(
+        email=EMAIL,
+        password_hash=passwords.pwd_ctx.hash(PASSWORD),
+        phone="70000000000",
+        type_account=0,
+        first_name="Bench",
+        is_admin=False,
+        is_blocked=False,
+        created_at=datetime.utcnow(),
+    ))
+
+    print(f"bcrypt rounds={passwords.BCRYPT_ROUNDS}, workers={passwords.PASSWORD_WORKERS}, "
+          f"logins={args.logins}, concurrency={args.concurrency}")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for mode in args.modes:
+            await run_mode(client, mode, args.logins, args.concurrency, args.interval)
+    print("pool stats:", passwords.password_stats())
+    await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.02, help="пауза между пробами GET /, с")
+    parser.add_argument("--modes", nargs="+", default=["inline", "pool"], choices=["inline", "pool"])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,109 @@
+"""
+Смешанная нагрузка чтение/запись на SQLite: обычный режим databases против
+режима SQLITE_TUNING (WAL + pragma, пул соединений, один писатель с пачками).
+
+Оба прогона идут по своему временному файлу с одинаковыми данными и одной
+и той же смесью запросов bench/bench_db.py; доля записей задаётся --write-ratio.
+На выходе — пропускная способность, p50/p95/p99 и ошибки ("database is locked")
+по чтениям и записям, плюс средний размер пачки писателя.
+
+Запуск из папки back:
+    python -m bench.bench_sqlite --concurrency 200 --duration 10 --write-ratio 0.3
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from bench.bench_db import seed, build_ops, worker
+from bench.load_test import percentile
+from db.db import MeteredDatabase, SQLiteDatabase, metadata
+from db.migrations import run_migrations
+
+READ_MIX = {"user": 5, "history": 3, "consents": 2}
+
+
+async def prepare(url: str):
+    engine = create_async_engine(url, poolclass=NullPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    async with engine.begin() as conn:
+        await conn.run_sync(run_migrations)
+    await engine.dispose()
+
+
+async def run(name: str, db, args) -> dict:
+    await db.connect()
+    try:
+        accounts = await seed(args.users, args.messages, db)
+        ops = build_ops(db, db)
+        reads = sum(READ_MIX.values())
+        if args.write_ratio >= 1:
+            weights = {"write": 1}
+        else:
+            weights = dict(READ_MIX)
+            if args.write_ratio > 0:
+                weights["write"] = reads * args.write_ratio / (1 - args.write_ratio)
+        results = {op: {"latency": [], "errors": {}} for op in weights}
+
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(worker(accounts, ops, weights, deadline, results) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await db.disconnect()
+
+    read_lat = [x for op, r in results.items() if op != "write" for x in r["latency"]]
+    write_lat = results.get("write", {"latency": []})["latency"]
+    errors = {}
+    for r in results.values():
+        for key, count in r["errors"].items():
+            errors[key] = errors.get(key, 0) + count
+    writer = getattr(db, "writer", None)
+    return {
+        "name": name, "elapsed": elapsed, "read": read_lat, "write": write_lat, "errors": errors,
+        "writer": writer.stats() if writer else None,
+    }
+
+
+def report(result: dict):
+    elapsed = result["elapsed"]
+    total = result["read"] + result["write"]
+    print(f"\n[{result['name']}] {len(total) / elapsed:.1f} req/s, errors: {result['errors'] or 0}")
+    print(f"{'kind':<8}{'req':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for kind in ("read", "write"):
+        lat = result[kind]
+        print(f"{kind:<8}{len(lat):>8}{len(lat) / elapsed:>9.1f}"
+              f"{percentile(lat, 50):>9.1f}{percentile(lat, 95):>9.1f}{percentile(lat, 99):>9.1f}")
+    if result["writer"]:
+        print(f"writer: {result['writer']}")
+
+
+async def main(args):
+    tmp = tempfile.mkdtemp()
+    modes = {
+        "plain": lambda url: MeteredDatabase(url),
+        "tuned": lambda url: SQLiteDatabase(url),
+    }
+    print(f"concurrency={args.concurrency} duration={args.duration}s write_ratio={args.write_ratio}")
+    for name, make in modes.items():
+        if args.mode not in ("both", name):
+            continue
+        url = f"sqlite+aiosqlite:///{os.path.join(tmp, f'bench_{name}.db')}"
+        await prepare(url)
+        report(await run(name, make(url), args))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10, help="секунд замера на режим")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=50, help="сообщений истории на пользователя")
+    parser.add_argument("--write-ratio", type=float, default=0.3, help="доля записей в смеси, 0..1")
+    parser.add_argument("--mode", choices=("both", "plain", "tuned"), default="both")
+    asyncio.run(main(parser.parse_args()))
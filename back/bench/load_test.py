@@ -0,0 +1,219 @@
+"""
+Нагрузочный прогон бэкенда: смесь запросов с заданной параллельностью,
+на выходе p50/p95/p99 и пропускная способность по каждому сценарию.
+
+Обычно бэкенд смотрит в локальный мок (bench/mock_bank.py), тогда прогон
+полностью воспроизводим без доступа к песочницам банков:
+
+    python -m bench.mock_bank --port 9000 --latency-ms 80 &
+    BANK_URL_VBANK=http://127.0.0.1:9000/vbank BANK_URL_ABANK=http://127.0.0.1:9000/abank \\
+    BANK_URL_SBANK=http://127.0.0.1:9000/sbank AI_BASE_URL=http://127.0.0.1:9000/llm/ \\
+    CLIENT_ID=team000 CLIENT_SECRET=secret uvicorn main:app --port 8000 &
+    python -m bench.load_test --base-url http://127.0.0.1:8000 --concurrency 50 --duration 30
+
+Сценарии и веса: --mix accounts=4,accounts_all=1,transactions=2,status=3,status_all=1,chat=1
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import httpx
+
+DEFAULT_MIX = "accounts=4,accounts_all=1,transactions=2,status=3,status_all=1,chat=1"
+QUESTIONS = ["На что я трачу больше всего?", "Сколько я потратил за месяц?", "Как мне сэкономить?"]
+
+
+class BenchUser:
+    def __init__(self, email: str, token: str):
+        self.email = email
+        self.token = token
+        self.accounts: list[tuple[str, str]] = []   # (bank, accountId)
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+# ---------- Подготовка ----------
+async def create_user(client: httpx.AsyncClient, run_id: str, n: int, banks: list[str]) -> BenchUser:
+    email = f"bench-{run_id}-{n}@example.com"
+    password = "bench-password"
+    phone = f"7{random.randrange(10**9, 10**10)}"
+    resp = await client.post("/auth/register", json={
+        "email": email, "password": password, "phone": phone, "type_account": 0, "first_name": "Bench",
+    })
+    resp.raise_for_status()
+    resp = await client.post("/auth/token", data={"username": email, "password": password})
+    resp.raise_for_status()
+    user = BenchUser(email, resp.json()["access_token"])
+
+    for bank in banks:
+        resp = await client.post(f"/banks/{bank}/connect", headers=user.headers)
+        resp.raise_for_status()
+        # Если мок одобряет согласие с задержкой — ждём
+        for _ in range(60):
+            status = (await client.get(f"/banks/{bank}/status", params={"refresh": True}, headers=user.headers)).json()
+            if status.get("connected"):
+                break
+            await asyncio.sleep(1)
+        resp = await client.get("/accounts", params={"bank": bank}, headers=user.headers)
+        resp.raise_for_status()
+        user.accounts += [(bank, a["accountId"]) for a in resp.json().get("accounts", [])]
+    return user
+
+
+# ---------- Сценарии ----------
+def build_scenarios(banks: list[str]) -> dict:
+    async def accounts(client, user):
+        return await client.get("/accounts", params={"bank": random.choice(banks)}, headers=user.headers)
+
+    async def accounts_all(client, user):
+        return await client.get("/accounts/all", headers=user.headers)
+
+    async def transactions(client, user):
+        bank, account_id = random.choice(user.accounts)
+        return await client.get(f"/accounts/{account_id}/transactions/full",
+                                params={"bank": bank}, headers=user.headers)
+
+    async def transactions_refresh(client, user):
+        bank, account_id = random.choice(user.accounts)
+        return await client.get(f"/accounts/{account_id}/transactions/full",
+                                params={"bank": bank, "refresh": True}, headers=user.headers)
+
+    async def status(client, user):
+        return await client.get(f"/banks/{random.choice(banks)}/status", headers=user.headers)
+
+    async def status_all(client, user):
+        return await client.get("/banks/status", headers=user.headers)
+
+    async def chat(client, user):
+        return await client.post("/ai/chat", json={"message": random.choice(QUESTIONS), "bank": random.choice(banks)},
+                                 headers=user.headers)
+
+    return {
+        "accounts": accounts,
+        "accounts_all": accounts_all,
+        "transactions": transactions,
+        "transactions_refresh": transactions_refresh,
+        "status": status,
+        "status_all": status_all,
+        "chat": chat,
+    }
+
+
+def parse_mix(mix: str, known: dict) -> dict[str, float]:
+    weights = {}
+    for part in filter(None, mix.split(",")):
+        name, _, weight = part.partition("=")
+        if name not in known:
+            raise SystemExit(f"Неизвестный сценарий: {name} (есть: {', '.join(known)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+# ---------- Прогон ----------
+async def worker(client, users, scenarios, weights, deadline, results):
+    names, w = list(weights), list(weights.values())
+    while time.perf_counter() < deadline:
+        name = random.choices(names, w)[0]
+        user = random.choice(users)
+        started = time.perf_counter()
+        try:
+            resp = await scenarios[name](client, user)
+            ok = resp.status_code < 400
+            code = resp.status_code
+        except httpx.HTTPError as e:
+            ok, code = False, type(e).__name__
+        results[name]["latency"].append((time.perf_counter() - started) * 1000)
+        if not ok:
+            results[name]["errors"][str(code)] = results[name]["errors"].get(str(code), 0) + 1
+
+
+async def run(args):
+    banks = args.banks.split(",")
+    scenarios = build_scenarios(banks)
+    weights = parse_mix(args.mix, scenarios)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(args.timeout)
+
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=timeout) as client:
+        run_id = uuid.uuid4().hex[:8]
+        users = await asyncio.gather(*(create_user(client, run_id, n, banks) for n in range(args.users)))
+        users = [u for u in users if u.accounts] or list(users)
+        if "transactions" in weights and not any(u.accounts for u in users):
+            raise SystemExit("У тестовых пользователей нет счетов — сценарий transactions невозможен")
+        print(f"users={len(users)} accounts/user={len(users[0].accounts)} "
+              f"concurrency={args.concurrency} duration={args.duration}s mix={args.mix}")
+
+        if args.warmup:
+            warm = {name: {"latency": [], "errors": {}} for name in weights}
+            deadline = time.perf_counter() + args.warmup
+            await asyncio.gather(*(worker(client, users, scenarios, weights, deadline, warm)
+                                   for _ in range(args.concurrency)))
+
+        results = {name: {"latency": [], "errors": {}} for name in weights}
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(worker(client, users, scenarios, weights, deadline, results)
+                               for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    report = {"elapsed_s": round(elapsed, 2), "concurrency": args.concurrency, "scenarios": {}}
+    all_latency, all_errors = [], 0
+    for name, r in results.items():
+        lat = r["latency"]
+        errors = sum(r["errors"].values())
+        all_latency += lat
+        all_errors += errors
+        report["scenarios"][name] = {
+            "requests": len(lat),
+            "errors": r["errors"],
+            "rps": round(len(lat) / elapsed, 1),
+            "p50_ms": round(percentile(lat, 50), 1),
+            "p95_ms": round(percentile(lat, 95), 1),
+            "p99_ms": round(percentile(lat, 99), 1),
+            "max_ms": round(max(lat), 1) if lat else 0.0,
+        }
+    report["total"] = {
+        "requests": len(all_latency),
+        "errors": all_errors,
+        "rps": round(len(all_latency) / elapsed, 1),
+        "p50_ms": round(percentile(all_latency, 50), 1),
+        "p95_ms": round(percentile(all_latency, 95), 1),
+        "p99_ms": round(percentile(all_latency, 99), 1),
+    }
+
+    print(f"{'scenario':<22}{'req':>7}{'err':>6}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, s in report["scenarios"].items():
+        print(f"{name:<22}{s['requests']:>7}{sum(s['errors'].values()):>6}{s['rps']:>8}"
+              f"{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}{s['max_ms']:>9}")
+    t = report["total"]
+    print(f"{'TOTAL':<22}{t['requests']:>7}{t['errors']:>6}{t['rps']:>8}{t['p50_ms']:>9}{t['p95_ms']:>9}{t['p99_ms']:>9}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"report saved to {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="секунд замера")
+    parser.add_argument("--warmup", type=float, default=3, help="секунд прогрева (не входит в отчёт)")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--banks", default="vbank,abank,sbank")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", help="куда сохранить отчёт в JSON")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,301 @@
+"""
+Локальный мок Open Banking API (vbank/abank/sbank) и OpenAI-совместимой LLM.
+
+Отдаёт ровно то, чем пользуется бэкенд: /auth/bank-token, /account-consents/*,
+/accounts, /accounts/{id}/balances, постраничные /accounts/{id}/transactions
+и /llm/chat/completions (в том числе stream). Данные детерминированы:
+одинаковые настройки → одинаковые счета и транзакции.
+
+Запуск из папки back:
+    python -m bench.mock_bank --port 9000 --latency-ms 80 --transactions 2000
+
+Бэкенд направляется на мок переменными окружения:
+    BANK_URL_VBANK=http://127.0.0.1:9000/vbank
+    BANK_URL_ABANK=http://127.0.0.1:9000/abank
+    BANK_URL_SBANK=http://127.0.0.1:9000/sbank
+    AI_BASE_URL=http://127.0.0.1:9000/llm/
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, FastAPI, Header, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+CATEGORIES = ["Супермаркеты", "Кафе и рестораны", "Транспорт", "Связь", "Развлечения", "Аптеки", "Одежда"]
+MERCHANTS = ["Пятёрочка", "Перекрёсток", "Яндекс Go", "МТС", "Кинопоиск", "Аптека 36,6", "Lamoda", "Шоколадница"]
+
+
+class MockConfig:
+    """Настройки мока: MOCK_* из окружения, аргументы командной строки поверх"""
+
+    def __init__(self):
+        self.latency_ms = float(os.getenv("MOCK_LATENCY_MS", "50"))       # средняя задержка ответа банка
+        self.jitter_ms = float(os.getenv("MOCK_JITTER_MS", "20"))         # разброс задержки (σ)
+        self.error_rate = float(os.getenv("MOCK_ERROR_RATE", "0"))        # доля ответов 500
+        self.throttle_rate = float(os.getenv("MOCK_THROTTLE_RATE", "0"))  # доля ответов 429
+        self.accounts = int(os.getenv("MOCK_ACCOUNTS", "3"))              # счетов на клиента
+        self.transactions = int(os.getenv("MOCK_TRANSACTIONS", "500"))    # транзакций на счёт
+        self.page_size = int(os.getenv("MOCK_PAGE_SIZE", "0"))            # 0 — как просит клиент (limit)
+        self.consent_delay = float(os.getenv("MOCK_CONSENT_DELAY", "0"))  # через сколько секунд согласие одобряется
+        self.llm_latency_ms = float(os.getenv("MOCK_LLM_LATENCY_MS", "500"))
+        self.llm_error_rate = float(os.getenv("MOCK_LLM_ERROR_RATE", "0"))
+        self.seed = int(os.getenv("MOCK_SEED", "42"))
+
+
+config = MockConfig()
+
+# request_id / consent_id -> {"consent_id", "created", "revoked"}
+_consents: dict[str, dict] = {}
+# (bank, account_id) -> список транзакций (новые сверху)
+_history: dict[tuple[str, str], list] = {}
+_stats = {"requests": 0, "errors": 0, "throttled": 0}
+
+
+def _rng(*parts) -> random.Random:
+    key = ":".join(map(str, (config.seed, *parts)))
+    return random.Random(zlib.crc32(key.encode()))
+
+
+async def _delay(mean_ms: float, jitter_ms: float):
+    ms = max(0.0, random.gauss(mean_ms, jitter_ms)) if jitter_ms else mean_ms
+    if ms:
+        await asyncio.sleep(ms / 1000)
+
+
+def _fault() -> Response | None:
+    """Случайный отказ банка согласно error_rate / throttle_rate"""
+    roll = random.random()
+    if roll < config.throttle_rate:
+        _stats["throttled"] += 1
+        return JSONResponse({"error": "Too Many Requests"}, status_code=429, headers={"Retry-After": "1"})
+    if roll < config.throttle_rate + config.error_rate:
+        _stats["errors"] += 1
+        return JSONResponse({"error": "Internal Server Error"}, status_code=500)
+    return None
+
+
+def _account_ids(bank: str, client_id: str | None) -> list[str]:
+    owner = zlib.crc32(f"{bank}:{client_id}".encode()) % 100000
+    return [f"acc-{owner:05d}-{k}" for k in range(1, config.accounts + 1)]
+
+
+def _transactions(bank: str, account_id: str) -> list:
+    key = (bank, account_id)
+    if key not in _history:
+        rng = _rng(bank, account_id)
+        now = datetime.utcnow().replace(microsecond=0)
+        items = []
+        for i in range(config.transactions):
+            credit = rng.random() < 0.15
+            k = rng.randrange(len(MERCHANTS))
+            items.append({
+                "transactionId": f"{account_id}-tx-{config.transactions - i:06d}",
+                "accountId": account_id,
+                "amount": {
+                    "amount": f"{rng.uniform(50, 50000 if credit else 8000):.2f}",
+                    "currency": "RUB",
+                },
+                "creditDebitIndicator": "Credit" if credit else "Debit",
+                "status": "Booked",
+                "bookingDateTime": (now - timedelta(hours=i * 7 + rng.random())).isoformat() + "Z",
+                "transactionInformation": "Зачисление зарплаты" if credit else f"Оплата {MERCHANTS[k]}",
+                "merchant": None if credit else {"name": MERCHANTS[k], "category": CATEGORIES[k % len(CATEGORIES)]},
+            })
+        _history[key] = items
+    return _history[key]
+
+
+# ---------- Банк ----------
+bank = APIRouter(prefix="/{bank_name}")
+
+
+@bank.post("/auth/bank-token")
+async def bank_token(bank_name: str, client_id: str = "", client_secret: str = ""):
+    return {"access_token": f"mock-{bank_name}-{uuid.uuid4().hex}", "token_type": "bearer", "expires_in": 86400}
+
+
+@bank.post("/account-consents/request")
+async def request_consent(bank_name: str, request: Request):
+    body = await request.json()
+    req_id = f"req-{uuid.uuid4().hex[:12]}"
+    consent_id = f"consent-{uuid.uuid4().hex[:12]}"
+    record = {"consent_id": consent_id, "created": time.monotonic(), "revoked": False,
+              "client_id": body.get("client_id")}
+    _consents[req_id] = _consents[consent_id] = record
+    if config.consent_delay > 0:
+        return {"request_id": req_id, "consent_id": None, "status": "pending"}
+    return {"request_id": req_id, "consent_id": consent_id, "status": "approved"}
+
+
+@bank.get("/account-consents/{consent_id}")
+async def get_consent(bank_name: str, consent_id: str):
+    record = _consents.get(consent_id)
+    if record is None:
+        # Мок перезапускали — считаем согласие действующим, чтобы не рвать БД бэкенда
+        return {"data": {"consentId": consent_id, "status": "Authorized"}}
+    if record["revoked"]:
+        return JSONResponse({"error": "Consent not found"}, status_code=404)
+    approved = time.monotonic() - record["created"] >= config.consent_delay
+    return {"data": {
+        "consentId": record["consent_id"],
+        "status": "Authorized" if approved else "AwaitingAuthorization",
+    }}
+
+
+@bank.delete("/account-consents/{consent_id}")
+async def revoke_consent(bank_name: str, consent_id: str):
+    record = _consents.get(consent_id)
+    if record is None or record["revoked"]:
+        return JSONResponse({"error": "Consent not found"}, status_code=404)
+    record["revoked"] = True
+    return Response(status_code=204)
+
+
+@bank.get("/accounts")
+async def list_accounts(bank_name: str, client_id: str | None = None,
+                        x_consent_id: str | None = Header(None)):
+    if not x_consent_id:
+        return JSONResponse({"error": "Consent required"}, status_code=403)
+    accounts = [
+        {
+            "accountId": account_id,
+            "status": "Enabled",
+            "currency": "RUB",
+            "accountType": "Personal",
+            "accountSubType": "CurrentAccount",
+            "nickname": f"Счёт {bank_name} №{k}",
+            "openingDate": "2023-01-01",
+            "account": [{
+                "schemeName": "RU.CBR.PAN",
+                "identification": f"40817810{zlib.crc32(account_id.encode()) % 10**12:012d}",
+                "name": "Текущий счёт",
+            }],
+        }
+        for k, account_id in enumerate(_account_ids(bank_name, client_id), 1)
+    ]
+    return {"data": {"account": accounts}}
+
+
+@bank.get("/accounts/{account_id}/balances")
+async def balances(bank_name: str, account_id: str):
+    amount = _rng(bank_name, account_id, "balance").uniform(1000, 500000)
+    return {"data": {"balance": [
+        {"type": "InterimAvailable", "creditDebitIndicator": "Credit",
+         "amount": {"amount": f"{amount:.2f}", "currency": "RUB"}},
+        {"type": "InterimBooked", "creditDebitIndicator": "Credit",
+         "amount": {"amount": f"{amount:.2f}", "currency": "RUB"}},
+    ]}}
+
+
+@bank.get("/accounts/{account_id}/transactions")
+async def transactions(bank_name: str, account_id: str, page: int = 1, limit: int = 50):
+    items = _transactions(bank_name, account_id)
+    size = config.page_size or max(1, limit)
+    total_pages = max(1, math.ceil(len(items) / size))
+    chunk = items[(page - 1) * size: page * size]
+    return {
+        "data": {"transaction": chunk},
+        "meta": {"totalPages": total_pages, "totalRecords": len(items), "page": page},
+    }
+
+
+# ---------- LLM ----------
+llm = APIRouter(prefix="/llm")
+
+REPLY = ("По вашим операциям основные траты приходятся на супермаркеты и кафе 🛒☕. "
+         "Попробуйте задать месячный лимит на эти категории 💡")
+
+
+def _completion(model: str) -> dict:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 40, "total_tokens": 140},
+    }
+
+
+@llm.post("/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "mock")
+    if random.random() < config.llm_error_rate:
+        return JSONResponse({"error": {"message": "mock overload"}}, status_code=503)
+
+    if not body.get("stream"):
+        await _delay(config.llm_latency_ms, config.llm_latency_ms / 5)
+        return _completion(model)
+
+    async def chunks():
+        words = REPLY.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(config.llm_latency_ms / 1000 / len(words))
+            delta = {"content": word if i == 0 else " " + word}
+            chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+# ---------- Приложение ----------
+app = FastAPI(title="Open Banking mock")
+
+
+@app.middleware("http")
+async def bank_conditions(request: Request, call_next):
+    """Задержка и случайные отказы для запросов к банкам"""
+    path = request.url.path
+    if path.startswith("/llm") or path.startswith("/_mock"):
+        return await call_next(request)
+    _stats["requests"] += 1
+    await _delay(config.latency_ms, config.jitter_ms)
+    return _fault() or await call_next(request)
+
+
+@app.get("/_mock/stats")
+async def mock_stats():
+    return {**_stats, "consents": len(_consents) // 2, "accounts_generated": len(_history)}
+
+
+app.include_router(bank)
+app.include_router(llm)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=config.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=config.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=config.error_rate)
+    parser.add_argument("--throttle-rate", type=float, default=config.throttle_rate)
+    parser.add_argument("--accounts", type=int, default=config.accounts)
+    parser.add_argument("--transactions", type=int, default=config.transactions)
+    parser.add_argument("--page-size", type=int, default=config.page_size)
+    parser.add_argument("--consent-delay", type=float, default=config.consent_delay)
+    parser.add_argument("--llm-latency-ms", type=float, default=config.llm_latency_ms)
+    parser.add_argument("--llm-error-rate", type=float, default=config.llm_error_rate)
+    parser.add_argument("--seed", type=int, default=config.seed)
+    args = parser.parse_args()
+    for name, value in vars(args).items():
+        if hasattr(config, name):
+            setattr(config, name, value)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
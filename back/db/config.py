@@ -0,0 +1,85 @@
+"""
+Настройки подключения к БД из окружения.
+
+URL основной БД — DATABASE_URL, а если его нет, DB_URL (так называется
+переменная в docker-compose); без обеих — локальный SQLite.
+postgres:// и postgresql:// приводятся к postgresql+asyncpg://, чтобы
+databases и SQLAlchemy смотрели в один и тот же драйвер.
+
+DATABASE_REPLICA_URL (или DB_REPLICA_URL) — необязательная реплика только
+для чтения: туда уходят история чата, статусы согласий и поиск пользователя.
+
+Пул asyncpg (Postgres):
+    DB_POOL_MIN / DB_POOL_MAX        — соединений в пуле воркера
+    DB_STATEMENT_CACHE_SIZE          — кэш подготовленных запросов на соединение
+                                       (0 — для pgbouncer в режиме transaction)
+    DB_CONNECT_TIMEOUT               — секунд на установку соединения
+    DB_COMMAND_TIMEOUT               — секунд на запрос на стороне клиента
+    DB_STATEMENT_TIMEOUT_MS          — statement_timeout на стороне сервера
+    DB_IDLE_LIFETIME                 — через сколько секунд простоя соединение закрывается
+"""
+import os
+from sqlalchemy.engine import make_url
+
+DEFAULT_URL = "sqlite+aiosqlite:///./vtb_api.db"
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "5"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "1024"))
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+DB_IDLE_LIFETIME = float(os.getenv("DB_IDLE_LIFETIME", "300"))
+
+
+def _env(*names: str) -> str | None:
+    for name in names:
+        value = os.getenv(name)
+        if value:
+            return value
+    return None
+
+
+def normalize_url(url: str | None) -> str | None:
+    """postgres://… → postgresql+asyncpg://…, остальное как есть"""
+    if not url:
+        return None
+    for prefix in ("postgres://", "postgresql://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+def is_postgres(url: str) -> bool:
+    return make_url(url).get_backend_name() in ("postgresql", "postgres")
+
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def database_options(url: str) -> dict:
+    """Параметры пула для databases.Database (уходят в asyncpg.create_pool)"""
+    if not is_postgres(url):
+        return {}
+    server_settings = {"application_name": os.getenv("DB_APPLICATION_NAME", "vtb-api")}
+    if DB_STATEMENT_TIMEOUT_MS:
+        server_settings["statement_timeout"] = str(DB_STATEMENT_TIMEOUT_MS)
+    return {
+        "min_size": DB_POOL_MIN,
+        "max_size": DB_POOL_MAX,
+        "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        "timeout": DB_CONNECT_TIMEOUT,
+        "command_timeout": DB_COMMAND_TIMEOUT,
+        "max_inactive_connection_lifetime": DB_IDLE_LIFETIME,
+        "server_settings": server_settings,
+    }
+
+
+def describe(url: str) -> str:
+    """URL для логов — без пароля"""
+    return make_url(url).render_as_string(hide_password=True)
+
+
+DATABASE_URL = normalize_url(_env("DATABASE_URL", "DB_URL")) or DEFAULT_URL
+REPLICA_URL = normalize_url(_env("DATABASE_REPLICA_URL", "DB_REPLICA_URL"))
@@ -1,15 +1,208 @@
 from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlalchemy import MetaData
 from databases import Database
-import os
+from databases.core import Connection
+import asyncio
+import sqlite3
+import time
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./vtb_api.db")
+try:
+    from asyncpg.exceptions import UniqueViolationError
+except ImportError:             # asyncpg нужен только для Postgres
+    UniqueViolationError = None
 
-# Асинхронная база данных
-database = Database(DATABASE_URL)
+from db.config import DATABASE_URL, REPLICA_URL, database_options, is_sqlite
+from db import sqlite
+from utils.metrics import db_queries, query_table
+from utils.tracing import span
 
-# Асинхронный движок SQLAlchemy
-engine = create_async_engine(DATABASE_URL, echo=False, future=True)
+
+class MeteredDatabase(Database):
+    """Database, который пишет время каждого запроса в метрики и спаны (операция + таблица)"""
+
+    def __init__(self, url: str, role: str = "primary", **options):
+        super().__init__(url, **options)
+        self.role = role
+
+    async def _timed(self, operation: str, query, call):
+        table = query_table(query)
+        started = time.perf_counter()
+        try:
+            with span("db", op=operation, table=table, db=self.role):
+                return await call
+        finally:
+            db_queries.observe(time.perf_counter() - started, operation=operation, table=table)
+
+    async def fetch_all(self, query, values=None):
+        return await self._timed("fetch_all", query, super().fetch_all(query, values))
+
+    async def fetch_one(self, query, values=None):
+        return await self._timed("fetch_one", query, super().fetch_one(query, values))
+
+    async def fetch_val(self, query, values=None, column=0):
+        return await self._timed("fetch_val", query, super().fetch_val(query, values, column))
+
+    async def execute(self, query, values=None):
+        return await self._timed("execute", query, super().execute(query, values))
+
+    async def execute_many(self, query, values):
+        return await self._timed("execute_many", query, super().execute_many(query, values))
+
+    async def iterate(self, query, values=None):
+        """Курсор: время и спан — от первого запроса до исчерпания или закрытия генератора"""
+        table = query_table(query)
+        started = time.perf_counter()
+        try:
+            # Database.iterate не закрывает вложенный генератор при раннем выходе,
+            # и соединение висело до сборки мусора — поэтому курсор открываем сами
+            async with self.connection() as connection:
+                cursor = connection.iterate(query, values)
+                try:
+                    with span("db", op="iterate", table=table, db=self.role):
+                        async for record in cursor:
+                            yield record
+                finally:
+                    await cursor.aclose()
+        finally:
+            db_queries.observe(time.perf_counter() - started, operation="iterate", table=table)
+
+
+class _WriterLockedTransaction:
+    """
+    database.transaction() в режиме SQLite: внешняя транзакция задачи держит замок писателя.
+    Владелец — сама задача, открывшая транзакцию: дочерние задачи её не наследуют
+    и пишут через очередь писателя.
+    """
+
+    def __init__(self, transaction, lock: asyncio.Lock, owners: set[asyncio.Task]):
+        self._transaction = transaction
+        self._lock = lock
+        self._owners = owners
+        self._owner = None
+
+    async def __aenter__(self):
+        task = asyncio.current_task()
+        if task not in self._owners:
+            await self._lock.acquire()
+            self._owners.add(task)
+            self._owner = task
+        try:
+            await self._transaction.__aenter__()
+        except BaseException:
+            self._unlock()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self._transaction.__aexit__(exc_type, exc, tb)
+        finally:
+            self._unlock()
+
+    def _unlock(self):
+        if self._owner is not None:
+            self._owners.discard(self._owner)
+            self._owner = None
+            self._lock.release()
+
+
+class SQLiteDatabase(MeteredDatabase):
+    """
+    SQLite с постоянными соединениями (pragma WAL и др.) и одним писателем:
+    одиночные записи вне транзакций уходят в очередь db.sqlite.SQLiteWriter
+    и коммитятся пачками, чтения идут параллельно по пулу.
+    """
+
+    # Пул с pragma подключается как обычный бэкенд databases (для sqlite:// и sqlite+aiosqlite://)
+    SUPPORTED_BACKENDS = {**Database.SUPPORTED_BACKENDS, "sqlite": "db.sqlite:TunedSQLiteBackend"}
+
+    def __init__(self, url: str, role: str = "primary", **options):
+        super().__init__(url, role, **options)
+        self.writer = sqlite.SQLiteWriter(lambda: Connection(self, self._backend))
+        # Задачи, открывшие явную транзакцию (и держащие замок писателя)
+        self._transaction_owners: set[asyncio.Task] = set()
+
+    async def connect(self):
+        await super().connect()
+        # Первое соединение переводит файл в WAL до того, как пойдут запросы
+        async with self.connection():
+            pass
+        self.writer.start()
+
+    async def disconnect(self):
+        await self.writer.stop()
+        await super().disconnect()
+
+    def transaction(self, **kwargs):
+        return _WriterLockedTransaction(super().transaction(**kwargs), self.writer.lock, self._transaction_owners)
+
+    def _use_writer(self, query) -> bool:
+        return (
+            self.writer.running
+            and asyncio.current_task() not in self._transaction_owners
+            and sqlite.is_write(query)
+        )
+
+    async def execute(self, query, values=None):
+        if not self._use_writer(query):
+            return await super().execute(query, values)
+        return await self._timed("execute", query, self.writer.submit(lambda conn: conn.execute(query, values)))
+
+    async def execute_many(self, query, values):
+        if not self._use_writer(query):
+            return await super().execute_many(query, values)
+        return await self._timed("execute_many", query,
+                                 self.writer.submit(lambda conn: conn.execute_many(query, values)))
+
+
+def _make_database(url: str, role: str = "primary") -> MeteredDatabase:
+    if is_sqlite(url) and sqlite.SQLITE_TUNING and ":memory:" not in url:
+        return SQLiteDatabase(url, role)
+    return MeteredDatabase(url, role, **database_options(url))
+
+
+# Асинхронная база данных — единственный путь запросов приложения
+database = _make_database(DATABASE_URL)
+
+# Реплика для чтений, которым не страшно небольшое отставание; без неё — та же основная БД
+read_database = (
+    _make_database(REPLICA_URL, role="replica") if REPLICA_URL else database
+)
+
+# Движок SQLAlchemy — только для DDL при старте (create_all, миграции):
+# своего пула не держит, чтобы не дублировать пул databases
+engine = create_async_engine(
+    DATABASE_URL, echo=False, future=True, poolclass=NullPool,
+    connect_args={"timeout": sqlite.SQLITE_BUSY_TIMEOUT_MS / 1000} if is_sqlite(DATABASE_URL) else {},
+)
 
 # Метаданные таблиц
 metadata = MetaData()
+
+
+def dialect_insert(table):
+    """insert() диалекта основной БД — с on_conflict_do_nothing/do_update (Postgres и SQLite)"""
+    if database.url.dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def is_unique_violation(e: BaseException) -> bool:
+    """Нарушение уникального ключа: databases пробрасывает исключения драйвера как есть"""
+    if isinstance(e, sqlite3.IntegrityError):
+        return str(e).startswith("UNIQUE constraint failed")
+    return UniqueViolationError is not None and isinstance(e, UniqueViolationError)
+
+
+async def fetch_one_read(query):
+    """
+    fetch_one с реплики; если там строки ещё нет (только что записали,
+    реплика отстаёт) — повторяем на основной БД.
+    """
+    row = await read_database.fetch_one(query)
+    if row is None and read_database is not database:
+        row = await database.fetch_one(query)
+    return row
@@ -0,0 +1,107 @@
+"""
+Версионированные миграции схемы.
+
+metadata.create_all создаёт только недостающие таблицы и не трогает существующие,
+поэтому индексы/ограничения для уже работающих БД накатываются здесь.
+Каждая миграция выполняется один раз; применённые версии хранятся в schema_migrations.
+Все шаги идемпотентны (IF NOT EXISTS), так что на свежей БД, где create_all
+уже всё создал, они просто ничего не меняют. Работает для SQLite и Postgres.
+"""
+import json
+from datetime import datetime
+from sqlalchemy import text, inspect
+from sqlalchemy.engine import Connection
+
+
+def _dedupe(conn: Connection, table: str, columns: str, prefer: str = ""):
+    """
+    Оставляет по одной строке на ключ — перед уникальным индексом.
+    prefer — SQL-выражение приоритета (больше — лучше), при равенстве берётся самая свежая.
+    """
+    order = f"{prefer} DESC, id DESC" if prefer else "id DESC"
+    conn.execute(text(
+        f"DELETE FROM {table} WHERE id NOT IN ("
+        f"SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY {columns} ORDER BY {order}) AS rn "
+        f"FROM {table}) ranked WHERE rn = 1)"
+    ))
+
+
+def _m001_hot_path_indexes(conn: Connection):
+    # Подтверждённое согласие важнее более свежей, но так и не одобренной заявки
+    _dedupe(conn, "bank_consents", "user_id, bank_name",
+            prefer="CASE WHEN status IN ('approved', 'Authorized') THEN 1 ELSE 0 END")
+    _dedupe(conn, "bank_tokens", "user_id, bank_name")
+    for stmt in (
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_bank_consents_user_bank ON bank_consents (user_id, bank_name)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_bank_tokens_user_bank ON bank_tokens (user_id, bank_name)",
+        "CREATE INDEX IF NOT EXISTS ix_ai_chat_user_created ON ai_chat (user_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_users_phone ON users (phone)",
+        "CREATE INDEX IF NOT EXISTS ix_users_inn ON users (inn)",
+    ):
+        conn.execute(text(stmt))
+
+
+def _m002_chat_session_index(conn: Connection):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_ai_chat_user_session ON ai_chat (user_id, session_id, created_at)"
+    ))
+
+
+def _m003_consent_checked_at(conn: Connection):
+    columns = {c["name"] for c in inspect(conn).get_columns("bank_consents")}
+    if "checked_at" not in columns:
+        conn.execute(text("ALTER TABLE bank_consents ADD COLUMN checked_at TIMESTAMP"))
+
+
+def _m004_spending_aggregates(conn: Connection):
+    """Агрегаты для уже сохранённых транзакций (дальше их ведёт tx_store)"""
+    from utils.spending import accumulate, aggregate_key, rows_to_values
+
+    conn.execute(text("DELETE FROM spending_aggregates"))
+    totals: dict = {}
+    rows = conn.execute(text(
+        "SELECT user_id, bank_name, account_id, booking_date, amount, credit_debit, raw FROM transactions"
+    ))
+    for r in rows.mappings():
+        values = dict(r)
+        if isinstance(values["booking_date"], str):
+            values["booking_date"] = datetime.fromisoformat(values["booking_date"])
+        accumulate(totals, aggregate_key(values, json.loads(values["raw"])), values)
+    if totals:
+        conn.execute(
+            text("INSERT INTO spending_aggregates (user_id, bank_name, account_id, month, category, spent, income, tx_count) "
+                 "VALUES (:user_id, :bank_name, :account_id, :month, :category, :spent, :income, :tx_count)"),
+            rows_to_values(totals),
+        )
+
+
+# (версия, описание, функция) — только добавлять в конец, не менять применённые
+MIGRATIONS = [
+    (1, "hot path indexes and one consent/token per bank", _m001_hot_path_indexes),
+    (2, "ai_chat session history index", _m002_chat_session_index),
+    (3, "bank_consents.checked_at for the background status poller", _m003_consent_checked_at),
+    (4, "spending_aggregates backfill from stored transactions", _m004_spending_aggregates),
+]
+
+
+def run_migrations(conn: Connection):
+    """Накатывает неприменённые миграции (вызывается через AsyncConnection.run_sync)"""
+    if conn.dialect.name == "postgresql":
+        # Несколько воркеров стартуют одновременно — миграции катит один
+        conn.execute(text("SELECT pg_advisory_xact_lock(727001)"))
+
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, description VARCHAR(255), applied_at TIMESTAMP)"
+    ))
+    applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        migrate(conn)
+        conn.execute(
+            text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+            {"v": version, "d": description, "t": datetime.utcnow()},
+        )
+        print(f"Migration {version} applied: {description}")
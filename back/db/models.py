@@ -1,4 +1,4 @@
-from sqlalchemy import Table, Column, Integer, String, Text, ForeignKey, DateTime, Boolean
+from sqlalchemy import Table, Column, Integer, String, Text, ForeignKey, DateTime, Boolean, Float, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from db.db import metadata, engine
 from datetime import datetime
@@ -22,6 +22,8 @@ users = Table(
     Column("is_admin", Boolean, server_default="false"),
     Column("is_blocked", Boolean, server_default="false"),
     Column("last_login", DateTime, server_default=func.now()),
+    Index("ix_users_phone", "phone"),
+    Index("ix_users_inn", "inn"),
     extend_existing=True,
 )
 
@@ -34,6 +36,7 @@ bank_tokens = Table(
     Column("bank_name", String, nullable=False),
     Column("access_token", String, nullable=False),
     Column("expires_at", DateTime, nullable=False),
+    Index("uq_bank_tokens_user_bank", "user_id", "bank_name", unique=True),
     extend_existing=True,
 )
 
@@ -49,6 +52,8 @@ bank_consents = Table(
     Column("client_id", String, nullable=True),
     Column("status", String, default="pending"),
     Column("created_at", DateTime, default=datetime.utcnow),
+    Column("checked_at", DateTime, nullable=True),   # когда статус последний раз сверяли с банком
+    Index("uq_bank_consents_user_bank", "user_id", "bank_name", unique=True),  # одно согласие на банк
 )
 
 # ---------- AI Чат ---------
@@ -61,6 +66,70 @@ ai_chat = Table(
     Column("message", Text, nullable=False),
     Column("session_id", String(64), nullable=True),  # для чатов по темам/контекстам
     Column("created_at", DateTime, server_default=func.now()),
+    Index("ix_ai_chat_user_created", "user_id", "created_at", "id"),
+    Index("ix_ai_chat_user_session", "user_id", "session_id", "created_at"),
+)
+
+# ---------- Сводки диалогов (память чата по сессиям) ---------
+ai_chat_summaries = Table(
+    "ai_chat_summaries",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+    Column("session_id", String(64), nullable=False),        # "" — сообщения без сессии
+    Column("summary", Text, nullable=False),
+    Column("covered_until", Integer, nullable=False),        # id последнего сообщения ai_chat в сводке
+    Column("updated_at", DateTime, default=datetime.utcnow),
+    UniqueConstraint("user_id", "session_id", name="uq_ai_chat_summaries_session"),
+)
+
+# ---------- Счета (локальная копия + водяной знак синхронизации) ---------
+accounts = Table(
+    "accounts",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+    Column("bank_name", String, nullable=False),
+    Column("account_id", String, nullable=False),
+    Column("raw", Text, nullable=True),                      # JSON счёта из банка
+    Column("last_booking_date", DateTime, nullable=True),    # самая свежая сохранённая транзакция
+    Column("synced_at", DateTime, nullable=True),            # время последней синхронизации
+    UniqueConstraint("user_id", "bank_name", "account_id", name="uq_accounts_user_bank_account"),
+)
+
+# ---------- Транзакции ---------
+transactions = Table(
+    "transactions",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+    Column("bank_name", String, nullable=False),
+    Column("account_id", String, nullable=False),
+    Column("transaction_id", String, nullable=False),
+    Column("booking_date", DateTime, nullable=True),
+    Column("amount", Float, nullable=True),
+    Column("currency", String(8), nullable=True),
+    Column("credit_debit", String(16), nullable=True),       # Credit | Debit
+    Column("information", String, nullable=True),            # transactionInformation
+    Column("raw", Text, nullable=False),                     # исходный JSON транзакции
+    UniqueConstraint("user_id", "bank_name", "account_id", "transaction_id", name="uq_transactions_key"),
+    Index("ix_transactions_account_date", "user_id", "bank_name", "account_id", "booking_date"),
+)
+
+# ---------- Агрегаты расходов (ведутся при синхронизации транзакций) ---------
+spending_aggregates = Table(
+    "spending_aggregates",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+    Column("bank_name", String, nullable=False),
+    Column("account_id", String, nullable=False),
+    Column("month", String(7), nullable=False),              # YYYY-MM, "" — без даты
+    Column("category", String, nullable=False),
+    Column("spent", Float, nullable=False, default=0.0),
+    Column("income", Float, nullable=False, default=0.0),
+    Column("tx_count", Integer, nullable=False, default=0),
+    UniqueConstraint("user_id", "bank_name", "account_id", "month", "category", name="uq_spending_aggregates_key"),
 )
 
 # Создание всех таблиц, если их ещё нет
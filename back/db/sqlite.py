@@ -0,0 +1,240 @@
+"""
+Режим SQLite для небольших установок.
+
+databases открывает на каждый запрос новое соединение aiosqlite (это поток
+и sqlite3.connect), а параллельные записи из разных соединений упираются
+в "database is locked". Здесь:
+
+- SQLiteConnectionPool — постоянные соединения (до SQLITE_POOL_SIZE), на каждом
+  при открытии выставляются pragma: WAL, synchronous=NORMAL, busy_timeout,
+  cache_size, mmap_size. В WAL читатели не мешают писателю и друг другу;
+- SQLiteWriter — единственный писатель: одиночные INSERT/UPDATE/DELETE из всех
+  запросов встают в очередь, а он забирает их пачкой (до SQLITE_WRITE_BATCH)
+  и коммитит одной транзакцией. Каждая запись — в своём SAVEPOINT, так что
+  ошибка одной (например, нарушение уникальности) не откатывает соседей.
+  Явные транзакции (database.transaction()) берут тот же замок, что и писатель.
+
+Пул подключается как бэкенд databases (TunedSQLiteBackend), параметры URL
+и опции Database уходят в aiosqlite.connect так же, как у штатного пула.
+
+Правило для кода внутри database.transaction(): не ждать задач, которые сами
+пишут в БД — они встанут в очередь за этой же транзакцией.
+
+Режим включается SQLITE_TUNING=1; по умолчанию — штатное поведение databases.
+"""
+import os
+import asyncio
+import sqlite3
+import aiosqlite
+from urllib.parse import urlencode
+from databases import DatabaseURL
+from databases.backends.sqlite import SQLiteBackend
+
+from utils.metrics import sqlite_write_batch
+
+SQLITE_TUNING = os.getenv("SQLITE_TUNING", "0").lower() in ("1", "true", "yes", "on")
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_WRITE_BATCH = int(os.getenv("SQLITE_WRITE_BATCH", "64"))
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",   # отрицательное — в килобайтах
+    f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+_WRITE_VERBS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+def is_write(query) -> bool:
+    """Одиночный DML-запрос, который можно отдать писателю"""
+    if isinstance(query, str):
+        words = query.lstrip().split(None, 1)
+        return bool(words) and words[0].upper() in _WRITE_VERBS
+    return bool(getattr(query, "is_dml", False))
+
+
+async def apply_pragmas(conn: aiosqlite.Connection):
+    for pragma in PRAGMAS:
+        async with conn.execute(pragma) as cursor:
+            await cursor.fetchall()
+
+
+class SQLiteConnectionPool:
+    """Замена SQLitePool из databases: соединения переиспользуются, pragma — один раз на соединение"""
+
+    def __init__(self, url: DatabaseURL, size: int, **options):
+        # Строка подключения и опции — как у SQLitePool: параметры URL дописываются
+        # к имени файла (file:...?mode=ro вместе с опцией uri=True)
+        self._database = url.database
+        if url.options:
+            self._database += "?" + urlencode(url.options)
+        self._options = options
+        # Общий кэш живёт, пока открыто хоть одно соединение; его сбрасывает SQLiteBackend.disconnect
+        self._memref = sqlite3.connect(self._database, **options) if "cache" in url.options else None
+        self.size = size
+        self._slots = asyncio.Semaphore(size)
+        self._idle: list[aiosqlite.Connection] = []
+        self.created = 0
+
+    async def acquire(self) -> aiosqlite.Connection:
+        await self._slots.acquire()
+        try:
+            if self._idle:
+                return self._idle.pop()
+            conn = aiosqlite.connect(self._database, isolation_level=None, **self._options)
+            # Поток соединения живёт в пуле и после запроса: если disconnect не
+            # позвали (скрипт, упавший старт), он не должен держать процесс
+            conn.daemon = True
+            await conn
+            try:
+                await apply_pragmas(conn)
+            except Exception:
+                await conn.close()
+                raise
+            self.created += 1
+            return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, conn: aiosqlite.Connection):
+        try:
+            if conn.in_transaction:
+                # Оборванная транзакция не должна достаться следующему запросу
+                await conn.rollback()
+            self._idle.append(conn)
+        except Exception:
+            await conn.close()
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        while self._idle:
+            await self._idle.pop().close()
+
+
+class TunedSQLiteBackend(SQLiteBackend):
+    """SQLiteBackend из databases с пулом постоянных соединений вместо соединения на запрос"""
+
+    def __init__(self, database_url, **options):
+        super().__init__(database_url, **options)
+        self._pool = SQLiteConnectionPool(self._database_url, SQLITE_POOL_SIZE, **options)
+
+    async def disconnect(self):
+        await super().disconnect()
+        await self._pool.close()
+
+
+class SQLiteWriter:
+    """Очередь одиночных записей и задача, которая коммитит их пачками"""
+
+    def __init__(self, connect, batch: int = SQLITE_WRITE_BATCH):
+        self._connect = connect        # () -> databases Connection для писателя
+        self.batch = batch
+        # Один писатель на процесс: его держит и writer, и явные транзакции
+        self.lock = asyncio.Lock()
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self.batches = 0
+        self.writes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        if not self.running:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописывает то, что уже в очереди, и останавливается"""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def submit(self, op):
+        """op(connection) выполняется писателем; возвращает его результат после коммита"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, future))
+        return await future
+
+    async def _run(self):
+        try:
+            connection = self._connect()
+            async with connection:
+                stopping = False
+                while not stopping:
+                    item = await self._queue.get()
+                    batch = []
+                    while item is not None:
+                        batch.append(item)
+                        if len(batch) >= self.batch or self._queue.empty():
+                            break
+                        item = self._queue.get_nowait()
+                    stopping = item is None
+                    if batch:
+                        async with self.lock:
+                            await self._commit(connection, batch)
+        finally:
+            # Писатель остановился (или упал) — никто не должен ждать вечно
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not None and not item[1].done():
+                    item[1].set_exception(RuntimeError("SQLite writer is not running"))
+
+    async def _commit(self, connection, batch: list):
+        live = [(op, fut) for op, fut in batch if not fut.cancelled()]
+        if not live:
+            return
+        results = []
+        try:
+            async with connection.transaction():
+                for op, _ in live:
+                    if len(live) == 1:
+                        results.append((await op(connection), None))
+                        continue
+                    try:
+                        async with connection.transaction():   # SAVEPOINT
+                            results.append((await op(connection), None))
+                    except Exception as e:
+                        results.append((None, e))
+        except Exception as e:
+            # Не удалось закоммитить пачку целиком (или единственная запись упала)
+            for _, fut in live:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        self.batches += 1
+        self.writes += len(live)
+        sqlite_write_batch.observe(len(live))
+        for (_, fut), (result, error) in zip(live, results):
+            if fut.done():
+                continue
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "batches": self.batches,
+            "writes": self.writes,
+            "avg_batch": round(self.writes / self.batches, 2) if self.batches else 0.0,
+        }
+
@@ -1,7 +1,9 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from utils.events import attach_db_events
-from routes import auth, banks, account,chat
+from utils.metrics import MetricsMiddleware
+from utils.tracing import TracingMiddleware
+from routes import auth, banks, account, chat, metrics
 
 app = FastAPI(title="MapTrack API", version="0.1.0")
 
@@ -23,11 +25,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Метрики времени ответа по каждому маршруту (GET /metrics)
+app.add_middleware(MetricsMiddleware)
+# Разбивка времени запроса: заголовок Server-Timing и лог медленных запросов
+app.add_middleware(TracingMiddleware)
+
 # Подключаем роуты
 app.include_router(auth.router)
 app.include_router(banks.router)
 app.include_router(account.router)
 app.include_router(chat.router)
+app.include_router(metrics.router)
 
 @app.get("/")
 def root():
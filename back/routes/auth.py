@@ -1,35 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Cookie, Response,Request
+from fastapi import APIRouter, Depends, HTTPException, status, Cookie, Response, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, EmailStr, constr
-from sqlalchemy import select
-from passlib.context import CryptContext
+from sqlalchemy import select, update
 from datetime import datetime, timedelta
 
 from utils.jwt import create_access_token, create_refresh_token, verify_token
 from utils.validation import check_validation
+from utils.auth import get_current_user, get_admin_user, invalidate_user
+from utils.passwords import hash_password, verify_password
+from utils.user_import import import_users, parse_csv, parse_json
 from db.models import users
 from db.db import database
 
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
-pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # стандартная схема для OAuth2 password flow
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
-# ==========================
-# Утилиты
-# ==========================
-def hash_password(password: str) -> str:
-    """Хэширует пароль с использованием bcrypt"""
-    return pwd_ctx.hash(password)
-
-def verify_password(password: str, hashed: str) -> bool:
-    """Проверяет соответствие пароля хэшу"""
-    return pwd_ctx.verify(password, hashed)
-
-
 # ==========================
 # Pydantic-схемы
 # ==========================
@@ -59,7 +48,7 @@ async def register_user(data: RegisterUserSchema):
     if not is_valid:
         raise HTTPException(status_code=400, detail=error)
 
-    hashed_pwd = hash_password(data.password)
+    hashed_pwd = await hash_password(data.password)
 
     query = users.insert().values(
         email=data.email,
@@ -110,6 +99,35 @@ async def register_user(data: RegisterUserSchema):
     return response
 
 
+# ==========================
+#  POST /auth/import — массовая регистрация (CSV или JSON)
+# ==========================
+@router.post("/import")
+async def import_users_bulk(request: Request, admin=Depends(get_admin_user)):
+    """
+    Импорт сотрудников пачкой. Тело — JSON (список или {"users": [...]}),
+    text/csv с заголовком или multipart-файл в поле file.
+    Возвращает отчёт по каждой строке; ошибки строк не прерывают импорт.
+    """
+    content_type = request.headers.get("content-type", "")
+    try:
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise ValueError("Нет файла в поле file")
+            raw = await upload.read()
+            name = (upload.filename or "").lower()
+            rows = parse_json(raw) if name.endswith(".json") else parse_csv(raw.decode("utf-8"))
+        elif "csv" in content_type:
+            rows = parse_csv((await request.body()).decode("utf-8"))
+        else:
+            rows = parse_json(await request.body())
+        return await import_users(rows)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Не удалось разобрать файл: {e}")
+
+
 # ==========================
 #  POST /auth/token — выдача access и refresh
 # ==========================
@@ -117,8 +135,15 @@ async def register_user(data: RegisterUserSchema):
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     query = select(users).where(users.c.email == form_data.username)
     user = await database.fetch_one(query)
-    if not user or not pwd_ctx.verify(form_data.password, user.password_hash):
+    if not user:
         raise HTTPException(status_code=400, detail="Неверный email или пароль")
+    valid, new_hash = await verify_password(form_data.password, user.password_hash)
+    if not valid:
+        raise HTTPException(status_code=400, detail="Неверный email или пароль")
+    if new_hash:
+        # Хэш посчитан со старыми параметрами — пересохраняем, раз пароль у нас в руках
+        await database.execute(update(users).where(users.c.id == user.id).values(password_hash=new_hash))
+        invalidate_user(user.email)
 
     if user.is_blocked:
         raise HTTPException(status_code=403, detail="Пользователь заблокирован")
@@ -183,23 +208,7 @@ async def refresh_token(refresh_token: str | None = Cookie(None)):
 #  GET /auth/me — защищённый ресурс
 # ==========================
 @router.get("/me")
-async def read_users_me(request: Request):
-    # Берём токен из куки
-    token = request.cookies.get("access_token")
-    if not token:
-        raise HTTPException(status_code=402, detail="Токен не найден в куках")
-
-    # Проверяем токен
-    payload = verify_token(token, token_type="access")
-    if not payload:
-        raise HTTPException(status_code=401, detail="Недействительный токен")
-
-    # Ищем пользователя
-    query = select(users).where(users.c.email == payload["sub"])
-    user = await database.fetch_one(query)
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-
+async def read_users_me(user=Depends(get_current_user)):
     return {
         "email": user.email,
         "first_name": user.first_name,
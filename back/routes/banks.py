@@ -1,149 +1,26 @@
 # routes/banks.py
-from fastapi import APIRouter, HTTPException, Depends,  Request, status
-from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy import select, insert, update, and_
-from datetime import datetime, timedelta
-import httpx, os, json
-
-from db.models import bank_tokens, bank_consents, users
-from db.db import database
-from utils.jwt import verify_token
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy import select, and_
+from datetime import datetime
+import httpx
+
+from db.models import bank_consents
+from db.db import database, dialect_insert, fetch_one_read
+from utils.auth import get_current_user
+from utils.bank_client import BANK_URLS, CLIENT_ID, get_bank_client
+from utils.bank_tokens import get_or_refresh_token
+from utils.bank_data import invalidate_accounts
+from utils.consents import get_consents, status_payload, sync_consent
 
 router = APIRouter(prefix="/banks", tags=["Banks"])
 
-BANK_URLS = {
-    "vbank": "https://vbank.open.bankingapi.ru",
-    "abank": "https://abank.open.bankingapi.ru",
-    "sbank": "https://sbank.open.bankingapi.ru",
-}
-
-CLIENT_ID = os.getenv("CLIENT_ID")
-CLIENT_SECRET = os.getenv("CLIENT_SECRET")
-
-
-# ---------- AUTH ----------
-
-async def get_current_user(request: Request):
-    # 1. Пробуем взять токен из cookie
-    token = request.cookies.get("access_token")
-
-    # 2. Если в cookie нет — пробуем из заголовка Authorization
-    if not token:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ", 1)[1]
-
-    if not token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Отсутствует токен пользователя",
-        )
-
-    payload = verify_token(token, token_type="access")
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Недействительный токен пользователя",
-        )
-
-    q = select(users).where(users.c.email == payload["sub"])
-    user = await database.fetch_one(q)
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-
-    return user
 
 # ---------- DB helpers ----------
-async def get_cached_token(user_id: int, bank: str):
-    q = select(bank_tokens).where(
-        and_(bank_tokens.c.user_id == user_id, bank_tokens.c.bank_name == bank)
-    )
-    rec = await database.fetch_one(q)
-    if rec and rec["expires_at"] and rec["expires_at"] > datetime.utcnow() + timedelta(minutes=5):
-        return rec["access_token"]
-    return None
-
-
-async def save_token(user_id: int, bank: str, token: str, expires_in: int):
-    expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
-    existing = await database.fetch_one(
-        select(bank_tokens).where(
-            and_(bank_tokens.c.user_id == user_id, bank_tokens.c.bank_name == bank)
-        )
-    )
-    if existing:
-        q = (
-            update(bank_tokens)
-            .where(bank_tokens.c.id == existing["id"])
-            .values(access_token=token, expires_at=expires_at)
-        )
-    else:
-        q = insert(bank_tokens).values(
-            user_id=user_id, bank_name=bank, access_token=token, expires_at=expires_at
-        )
-    await database.execute(q)
-
-
 async def get_cached_consent(user_id: int, bank: str):
     q = select(bank_consents).where(
         and_(bank_consents.c.user_id == user_id, bank_consents.c.bank_name == bank)
     )
-    return await database.fetch_one(q)
-
-
-async def save_consent(user_id: int, bank: str, consent_id: str, client_id: str, status: str):
-    q = insert(bank_consents).values(
-        user_id=user_id,
-        bank_name=bank,
-        consent_id=consent_id,
-        client_id=client_id,
-        status=status,
-        created_at=datetime.utcnow(),
-    )
-    await database.execute(q)
-
-
-# ---------- Network ----------
-async def request_bank(method: str, url: str, *, headers=None, params=None, json_body=None):
-    try:
-        async with httpx.AsyncClient(verify=False, trust_env=True, timeout=15.0) as client:
-            resp = await client.request(method, url, headers=headers, params=params, json=json_body)
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=503, detail=f"Ошибка при обращении к банку: {e!s}")
-
-    if resp.status_code >= 400:
-        try:
-            detail = resp.json()
-        except Exception:
-            detail = resp.text
-        raise HTTPException(status_code=resp.status_code, detail=detail)
-
-    try:
-        return resp.json()
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=502, detail="Банк вернул не-JSON ответ")
-
-
-# ---------- Token ----------
-async def get_or_refresh_token(user_id: int, bank: str):
-    if bank not in BANK_URLS:
-        raise HTTPException(status_code=400, detail="Неверный банк")
-    cached = await get_cached_token(user_id, bank)
-    if cached:
-        return cached
-
-    url = f"{BANK_URLS[bank]}/auth/bank-token"
-    data = await request_bank(
-        "POST", url, params={"client_id": CLIENT_ID, "client_secret": CLIENT_SECRET}
-    )
-
-    token = data.get("access_token")
-    exp = int(data.get("expires_in", 86400))
-    if not token:
-        raise HTTPException(status_code=502, detail="Банк не вернул access_token")
-
-    await save_token(user_id, bank, token, exp)
-    return token
+    return await fetch_one_read(q)
 
 
 # ---------- Endpoints ----------
@@ -192,8 +69,10 @@ async def connect_bank(bank: str, user=Depends(get_current_user)):
         "requesting_bank_name": "MapTrack",
     }
 
-    async with httpx.AsyncClient(verify=False) as client:
-        resp = await client.post(f"{BANK_URLS[bank]}/account-consents/request", headers=headers, json=body)
+    try:
+        resp = await get_bank_client(bank).post("/account-consents/request", headers=headers, json=body)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=503, detail=f"Ошибка при обращении к банку: {e!s}")
 
     if resp.status_code != 200:
         raise HTTPException(status_code=resp.status_code, detail=resp.text)
@@ -203,16 +82,29 @@ async def connect_bank(bank: str, user=Depends(get_current_user)):
     consent_id = data.get("consent_id")
     status = data.get("status", "pending")
 
-    await database.execute(
-        insert(bank_consents).values(
-            user_id=user.id,
-            bank_name=bank,
-            req_id=req_id,
-            consent_id=consent_id,
-            client_id=f"{CLIENT_ID}-{user.id}",
-            status=status,
-        )
+    # Старое согласие в другом статусе заменяем: на банк допускается одно согласие.
+    # Upsert, а не DELETE + INSERT: два параллельных connect не упрутся в уникальный индекс
+    stmt = dialect_insert(bank_consents).values(
+        user_id=user.id,
+        bank_name=bank,
+        req_id=req_id,
+        consent_id=consent_id,
+        client_id=f"{CLIENT_ID}-{user.id}",
+        status=status,
+        created_at=datetime.utcnow(),
     )
+    await database.execute(stmt.on_conflict_do_update(
+        index_elements=[bank_consents.c.user_id, bank_consents.c.bank_name],
+        set_={
+            "req_id": stmt.excluded.req_id,
+            "consent_id": stmt.excluded.consent_id,
+            "client_id": stmt.excluded.client_id,
+            "status": stmt.excluded.status,
+            "created_at": stmt.excluded.created_at,
+            "checked_at": None,
+        },
+    ))
+    invalidate_accounts(user.id, bank)
 
     return {
         "message": "Согласие создано",
@@ -223,80 +115,26 @@ async def connect_bank(bank: str, user=Depends(get_current_user)):
         "connected": status in ["approved", "Authorized"]
     }
 
+@router.get("/status")
+async def get_all_banks_status(user=Depends(get_current_user)):
+    """Статусы согласий по всем банкам одним запросом (из БД, без обращения к банкам)"""
+    records = await get_consents(user.id)
+    return {"banks": [status_payload(bank, records.get(bank)) for bank in BANK_URLS]}
+
+
 @router.get("/{bank}/status")
-async def get_bank_status(bank: str, user=Depends(get_current_user)):
-    """Проверяет статус согласия в банке и синхронизирует с БД"""
+async def get_bank_status(bank: str, refresh: bool = Query(False), user=Depends(get_current_user)):
+    """
+    Статус согласия из БД — его держит актуальным фоновый опросчик (utils/consents.py).
+    refresh=true сверяет согласие с банком прямо сейчас.
+    """
     if bank not in BANK_URLS:
         raise HTTPException(status_code=400, detail="Неверный банк")
 
-    record = await database.fetch_one(
-        select(bank_consents).where(
-            (bank_consents.c.user_id == user.id) &
-            (bank_consents.c.bank_name == bank)
-        )
-    )
-    if not record:
-        return {
-            "bank": bank,
-            "status": "not_connected",
-            "connected": False
-        }
-    consent_id = record["consent_id"] or record["req_id"]
-    local_status = record["status"]
-
-    token = await get_or_refresh_token(user.id, bank)
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "X-Requesting-Bank": CLIENT_ID,
-    }
-
-    url = f"{BANK_URLS[bank]}/account-consents/{consent_id}"
-    try:
-        async with httpx.AsyncClient(verify=False, timeout=10.0) as client:
-            resp = await client.get(url, headers=headers)
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=503, detail=f"Ошибка при обращении к банку: {str(e)}")
-
-    if resp.status_code == 404:
-        await database.execute(bank_consents.delete().where(bank_consents.c.id == record["id"]))
-        return {
-            "bank": bank,
-            "status": "revoked",
-            "connected": False,
-            "message": "Согласие отозвано (404) и удалено локально"
-        }
-
-    if resp.status_code != 200:
-        raise HTTPException(status_code=resp.status_code, detail=resp.text)
-    data = resp.json().get("data", {})
-    new_status = data.get("status", local_status)
-    new_consent_id = data.get("consentId", consent_id)
-
-    if new_status.lower() in ["revoked", "rejected"]:
-        await database.execute(bank_consents.delete().where(bank_consents.c.id == record["id"]))
-        return {
-            "bank": bank,
-            "status": new_status,
-            "connected": False,
-            "message": f"Согласие {new_status.lower()} и удалено из базы"
-        }
-
-    if new_status != local_status or new_consent_id != consent_id:
-        await database.execute(
-            update(bank_consents)
-            .where(bank_consents.c.id == record["id"])
-            .values(status=new_status, consent_id=new_consent_id)
-        )
-
-    connected = new_status in ["approved", "Authorized"]
-
-    return {
-        "bank": bank,
-        "status": new_status,
-        "req_id": record["req_id"],
-        "consent_id": new_consent_id,
-        "connected": connected
-    }
+    record = await get_cached_consent(user.id, bank)
+    if record and refresh:
+        return await sync_consent(record)
+    return status_payload(bank, record)
 
 @router.delete("/{bank}/revoke")
 async def revoke_consent(bank: str, user=Depends(get_current_user)):
@@ -318,18 +156,20 @@ async def revoke_consent(bank: str, user=Depends(get_current_user)):
     if not consent_id:
         raise HTTPException(status_code=400, detail="Нет доступного идентификатора согласия")
 
-    url = f"{BANK_URLS[bank]}/account-consents/{consent_id}"
     headers = {
         "x-fapi-interaction-id": CLIENT_ID,  # может быть team239
     }
 
-    async with httpx.AsyncClient(verify=False, timeout=10.0) as client:
-        resp = await client.delete(url, headers=headers)
+    try:
+        resp = await get_bank_client(bank).delete(f"/account-consents/{consent_id}", headers=headers)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=503, detail=f"Ошибка при обращении к банку: {e!s}")
 
     if resp.status_code == 204:
         await database.execute(
             bank_consents.delete().where(bank_consents.c.id == record["id"])
         )
+        invalidate_accounts(user.id, bank)
         return {
             "message": "Согласие успешно отозвано",
             "bank": bank,
@@ -342,6 +182,7 @@ async def revoke_consent(bank: str, user=Depends(get_current_user)):
         await database.execute(
             bank_consents.delete().where(bank_consents.c.id == record["id"])
         )
+        invalidate_accounts(user.id, bank)
         return {
             "message": "Согласие не найдено у банка, локальная запись удалена",
             "bank": bank,
@@ -1,99 +1,238 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, status
-import httpx
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+import base64
+import json
 from db.models import ai_chat
-from db.db import database
-from utils.llm import ask_ai
-from routes.account import get_current_user
-from utils.analytics import make_spending_summary
-from sqlalchemy import select, asc
+from db.db import database, read_database
+from utils.llm import ask_ai_cached, ask_ai_stream, build_messages, cache_key, estimate_tokens, FALLBACK_REPLY
+from utils.answer_cache import get_answer, put_answer
+from utils.auth import get_current_user
+from utils.bank_client import BANK_URLS
+from utils.spending import chat_context
+from utils.chat_memory import CHAT_PROMPT_TOKENS, ChatMemory, load_memory, record_prompt_size, schedule_summary
+from sqlalchemy import select, asc, desc, and_, or_
 
 router = APIRouter(prefix="/ai", tags=["AI Chat"])
 
-BASE_URL = "http://localhost:8000"
-
-@router.post("/chat")
-async def ai_chat_route(msg: dict, request: Request, user=Depends(get_current_user)):
+async def prepare_chat(msg: dict, user) -> tuple[str, str, int, str, ChatMemory]:
+    """
+    Проверяет сообщение, сохраняет его и собирает контекст для модели.
+    Контекст строится из агрегатов расходов в БД — без запросов к банку;
+    агрегаты обновляются при каждой синхронизации транзакций.
+    Память диалога (сводка + последние реплики сессии session_id) занимает
+    то, что осталось от бюджета CHAT_PROMPT_TOKENS после вопроса и контекста.
+    Возвращает (сообщение, банк, число транзакций в контексте, контекст, память).
+    """
     user_message = msg.get("message")
     bank = msg.get("bank")
+    session_id = msg.get("session_id")
 
     if not user_message:
         raise HTTPException(status_code=400, detail="Пустое сообщение")
     if not bank:
         raise HTTPException(status_code=400, detail="Не указан банк")
+    if bank not in BANK_URLS:
+        raise HTTPException(status_code=400, detail="Неверный банк")
+    if session_id is not None and (not isinstance(session_id, str) or not 0 < len(session_id) <= 64):
+        raise HTTPException(status_code=400, detail="Неверный session_id")
+
+    context, tx_count = await chat_context(user.id, bank)
+    prompt_tokens = sum(estimate_tokens(m["content"]) for m in build_messages(user_message, context))
+    if prompt_tokens > CHAT_PROMPT_TOKENS:
+        raise HTTPException(status_code=400, detail="Слишком длинное сообщение")
 
-    # Получаем токен из cookie
-    token = request.cookies.get("access_token")
-    if not token:
-        raise HTTPException(status_code=401, detail="Нет access_token в cookie")
+    # Историю читаем до записи вопроса — он уйдёт в промпт отдельно
+    memory = await load_memory(user.id, session_id, CHAT_PROMPT_TOKENS - prompt_tokens)
+    record_prompt_size(memory, estimate_tokens(user_message), estimate_tokens(context),
+                       prompt_tokens + memory.summary_tokens + memory.history_tokens)
 
     await database.execute(ai_chat.insert().values(
         user_id=user.id,
         role="user",
-        message=user_message
+        message=user_message,
+        session_id=session_id,
     ))
+    return user_message, bank, tx_count, context, memory
 
-    # Запрашиваем данные по счетам
-    transactions = []
-    async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-        acc_resp = await client.get(
-            f"{BASE_URL}/accounts",
-            params={"bank": bank},
-            headers={"Authorization": f"Bearer {token}"}
-        )
-
-        if acc_resp.status_code != 200:
-            raise HTTPException(status_code=acc_resp.status_code, detail=f"Ошибка при получении счетов: {acc_resp.text}")
-
-        accounts = acc_resp.json().get("accounts", [])
-        for acc in accounts:
-            acc_id = acc.get("accountId")
-            if not acc_id:
-                continue
-            tx_resp = await client.get(
-                f"{BASE_URL}/accounts/{acc_id}/transactions/full",
-                params={"bank": bank},
-                headers={"Authorization": f"Bearer {token}"}
-            )
-            if tx_resp.status_code == 200:
-                txs = tx_resp.json().get("transactions", [])
-                transactions.extend(txs)
-
-    context = f"Всего транзакций: {len(transactions)}"
-    ai_reply = await ask_ai(user_message, context)
 
+async def save_reply(user, memory: ChatMemory, ai_reply: str):
+    """Сохраняет ответ модели и, если пора, запускает пересборку сводки сессии"""
     await database.execute(ai_chat.insert().values(
         user_id=user.id,
         role="assistant",
-        message=ai_reply
+        message=ai_reply,
+        session_id=memory.session_id,
     ))
+    if memory.stale:
+        schedule_summary(user.id, memory.session_id)
+
+
+def bypass_cache(msg: dict, request: Request) -> bool:
+    """Ответ без кэша: {"no_cache": true} в теле или Cache-Control: no-cache"""
+    return bool(msg.get("no_cache")) or "no-cache" in request.headers.get("cache-control", "").lower()
+
+
+def sse(data: dict, event: str | None = None) -> str:
+    """Форматирует одно событие Server-Sent Events"""
+    payload = json.dumps(data, ensure_ascii=False)
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {payload}\n\n"
+
+
+@router.post("/chat")
+async def ai_chat_route(msg: dict, request: Request, user=Depends(get_current_user)):
+    user_message, bank, tx_count, context, memory = await prepare_chat(msg, user)
+    ai_reply, cached = await ask_ai_cached(user.id, user_message, context, bypass=bypass_cache(msg, request),
+                                           history=memory.messages())
+    await save_reply(user, memory, ai_reply)
 
     return {
         "bank": bank,
+        "session_id": memory.session_id,
         "user": user_message,
         "assistant": ai_reply,
-        "transactions_count": len(transactions)
+        "transactions_count": tx_count,
+        "cached": cached,
     }
 
+
+@router.post("/chat/stream")
+async def ai_chat_stream_route(msg: dict, request: Request, user=Depends(get_current_user)):
+    """
+    То же, что /ai/chat, но ответ приходит по мере генерации (text/event-stream).
+    События: data: {"delta": ...} для кусков текста, event: done — в конце,
+    event: error — если модель не ответила. Если клиент отключился, генерация
+    прерывается и неполный ответ не сохраняется.
+    """
+    user_message, bank, tx_count, context, memory = await prepare_chat(msg, user)
+    history = memory.messages()
+    key = cache_key(user.id, user_message, context, history)
+    cached = None if bypass_cache(msg, request) else get_answer(key)
+
+    async def events():
+        if cached is not None:
+            ai_reply = cached
+            yield sse({"delta": cached})
+        else:
+            parts = []
+            failed = False
+            tokens = ask_ai_stream(user_message, context, history)
+            try:
+                async for delta in tokens:
+                    if await request.is_disconnected():
+                        return
+                    parts.append(delta)
+                    yield sse({"delta": delta})
+            except Exception:
+                failed = True
+                yield sse({"message": FALLBACK_REPLY}, event="error")
+                if not parts:
+                    parts.append(FALLBACK_REPLY)
+            finally:
+                await tokens.aclose()
+
+            ai_reply = "".join(parts).strip()
+            if not failed and ai_reply:
+                put_answer(key, ai_reply)
+
+        await save_reply(user, memory, ai_reply)
+        yield sse({
+            "bank": bank,
+            "session_id": memory.session_id,
+            "assistant": ai_reply,
+            "transactions_count": tx_count,
+            "cached": cached is not None,
+        }, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # === ИСТОРИЯ ЧАТА ===
+HISTORY_PAGE_MAX = 200
+
+
+def encode_cursor(msg_id: int) -> str:
+    """Непрозрачный курсор keyset-пагинации: id последнего показанного сообщения"""
+    return base64.urlsafe_b64encode(str(msg_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Неверный курсор истории")
+
+
+def history_item(r) -> dict:
+    return {
+        "id": r["id"],
+        "role": r["role"],
+        "message": r["message"],
+        "session_id": r["session_id"],
+        "created_at": r["created_at"].isoformat()
+    }
+
+
 @router.get("/history")
-async def get_chat_history(user=Depends(get_current_user)):
+async def get_chat_history(
+    before: str | None = Query(None, description="Курсор: вернуть сообщения старше него"),
+    limit: int = Query(50, ge=1, le=HISTORY_PAGE_MAX),
+    session_id: str | None = Query(None, description="Только сообщения этой сессии"),
+    format: str = Query("json", pattern="^(json|ndjson)$", description="ndjson — потоковая выгрузка всей истории"),
+    user=Depends(get_current_user),
+):
     """
     Возвращает историю диалога пользователя с AI, отсортированную по времени.
+    По умолчанию — последняя страница; следующую (более старую) можно получить
+    по курсору next_before. format=ndjson отдаёт всю историю построчно, не держа её в памяти.
     """
+    conditions = [ai_chat.c.user_id == user.id]
+    if session_id is not None:
+        conditions.append(ai_chat.c.session_id == session_id)
+
+    if format == "ndjson":
+        query = (
+            select(ai_chat)
+            .where(and_(*conditions))
+            .order_by(asc(ai_chat.c.created_at), asc(ai_chat.c.id))
+        )
+
+        async def rows():
+            async for r in read_database.iterate(query):
+                yield json.dumps(history_item(r), ensure_ascii=False) + "\n"
+
+        return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+    if before:
+        # Сравниваем (created_at, id) с опорной строкой прямо в БД,
+        # чтобы не зависеть от формата хранения дат в конкретной СУБД
+        msg_id = decode_cursor(before)
+        anchor = select(ai_chat.c.created_at).where(ai_chat.c.id == msg_id).scalar_subquery()
+        conditions.append(or_(
+            ai_chat.c.created_at < anchor,
+            and_(ai_chat.c.created_at == anchor, ai_chat.c.id < msg_id),
+        ))
+
     query = (
         select(ai_chat)
-        .where(ai_chat.c.user_id == user.id)
-        .order_by(asc(ai_chat.c.created_at))
+        .where(and_(*conditions))
+        .order_by(desc(ai_chat.c.created_at), desc(ai_chat.c.id))
+        .limit(limit + 1)
     )
-    records = await database.fetch_all(query)
-
-    history = [
-        {
-            "role": r["role"],
-            "message": r["message"],
-            "created_at": r["created_at"].isoformat()
-        }
-        for r in records
-    ]
-
-    return {"user_id": user.id, "history": history, "count": len(history)}
+    records = await read_database.fetch_all(query)
+
+    has_more = len(records) > limit
+    records = list(reversed(records[:limit]))
+    history = [history_item(r) for r in records]
+    next_before = encode_cursor(records[0]["id"]) if has_more else None
+
+    return {
+        "user_id": user.id,
+        "history": history,
+        "count": len(history),
+        "has_more": has_more,
+        "next_before": next_before,
+    }
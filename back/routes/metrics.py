@@ -0,0 +1,21 @@
+import os
+import secrets
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from utils.metrics import render_metrics
+
+router = APIRouter(tags=["Metrics"])
+
+# Если задан — /metrics требует Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics(request: Request):
+    """Метрики в текстовом формате Prometheus"""
+    if METRICS_TOKEN:
+        auth = request.headers.get("Authorization", "")
+        if not secrets.compare_digest(auth, f"Bearer {METRICS_TOKEN}"):
+            raise HTTPException(status_code=401, detail="Нужен токен метрик")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
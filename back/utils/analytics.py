@@ -1,25 +1,14 @@
-def make_spending_summary(transactions):
-    if not transactions:
-        return "Данных о расходах пока нет."
+"""
+Категории расходов.
 
-    summary = {}
-    total = 0
+Единое правило, по которому транзакция попадает в категорию: категория
+мерчанта, иначе описание транзакции, иначе «Прочее». По нему ведутся
+агрегаты utils/spending.py (и их бэкфилл в миграциях).
+"""
+OTHER = "Прочее"
 
-    for tx in transactions:
-        try:
-            amt = float(tx["amount"]["amount"])
-            cat = tx.get("transactionInformation", "Прочее")
-            summary[cat] = summary.get(cat, 0) + amt
-            total += amt
-        except Exception:
-            continue
 
-    if not total:
-        return "Нет трат, подходящих под анализ."
-
-    lines = [f"Всего расходов: {total:.2f} ₽"]
-    for cat, amt in sorted(summary.items(), key=lambda x: x[1], reverse=True):
-        percent = amt / total * 100
-        lines.append(f"- {cat}: {amt:.2f} ₽ ({percent:.1f}%)")
-
-    return "\n".join(lines)
+def category_of(tx: dict) -> str:
+    """Категория транзакции банка: категория мерчанта, иначе описание транзакции"""
+    merchant = tx.get("merchant") or {}
+    return merchant.get("category") or tx.get("transactionInformation") or OTHER
@@ -0,0 +1,53 @@
+"""
+Кэш ответов LLM.
+
+Ключ — нормализованный вопрос + модель + отпечаток шаблона промпта + хэш
+контекста расходов + «поколение» данных пользователя. Повторный вопрос
+по тем же данным (в том числе двойной клик) не тратит токены. Как только
+у пользователя появляются новые транзакции, поколение растёт и старые
+ответы больше не находятся (вытеснятся по LRU/TTL).
+"""
+import os
+import re
+import json
+import hashlib
+
+from utils.cache import TTLCache
+
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+_answers = TTLCache("llm_answers", maxsize=int(os.getenv("ANSWER_CACHE_SIZE", "5000")), ttl=ANSWER_CACHE_TTL)
+# user_id -> номер поколения данных
+_generation: dict[int, int] = {}
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Регистр, ё/е, лишние пробелы и знаки в конце не меняют смысла вопроса"""
+    q = _SPACES.sub(" ", question.lower().replace("ё", "е")).strip()
+    return q.rstrip(" ?!.…")
+
+
+def answer_key(user_id: int, question: str, model: str, template: str, context: str) -> str:
+    parts = [
+        user_id,
+        _generation.get(user_id, 0),
+        normalize_question(question),
+        model,
+        template,
+        hashlib.sha256(context.encode()).hexdigest(),
+    ]
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode()).hexdigest()
+
+
+def get_answer(key: str) -> str | None:
+    return _answers.get(key)
+
+
+def put_answer(key: str, answer: str):
+    _answers.set(key, answer)
+
+
+def invalidate_user_answers(user_id: int):
+    """Данные пользователя изменились — все его закэшированные ответы больше не подходят"""
+    _generation[user_id] = _generation.get(user_id, 0) + 1
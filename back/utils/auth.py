@@ -0,0 +1,100 @@
+import os
+import time
+import hashlib
+from fastapi import HTTPException, Request, status
+from sqlalchemy import select
+
+from db.db import fetch_one_read
+from db.models import users
+from utils.jwt import verify_token
+from utils.cache import TTLCache
+from utils.tracing import span
+
+# Расшифрованные access-токены: ключ — sha256 токена, живут не дольше exp
+_token_cache = TTLCache("auth_tokens", maxsize=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000")), ttl=30 * 60)
+# Строки пользователей по email
+_user_cache = TTLCache("auth_users", maxsize=int(os.getenv("AUTH_USER_CACHE_SIZE", "10000")),
+                       ttl=float(os.getenv("AUTH_USER_CACHE_TTL", "60")))
+
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def decode_access_token_cached(token: str) -> dict | None:
+    """verify_token с кэшем: подпись проверяется один раз на токен"""
+    key = _token_digest(token)
+    payload = _token_cache.get(key)
+    if payload is not None:
+        return payload
+
+    payload = verify_token(token, token_type="access")
+    if payload and payload.get("sub"):
+        ttl = payload.get("exp", 0) - time.time()
+        _token_cache.set(key, payload, ttl=ttl)
+    return payload
+
+
+async def get_user_by_email(email: str):
+    """Строка пользователя из кэша или из БД"""
+    user = _user_cache.get(email)
+    if user is not None:
+        return user
+
+    user = await fetch_one_read(select(users).where(users.c.email == email))
+    if user:
+        _user_cache.set(email, user)
+    return user
+
+
+def invalidate_user(email: str):
+    """Сбрасывает кэш пользователя — вызывать после блокировки или изменения профиля"""
+    _user_cache.pop(email)
+
+
+def auth_cache_stats() -> dict:
+    return {"tokens": _token_cache.stats(), "users": _user_cache.stats()}
+
+
+# ---------- Зависимость FastAPI ----------
+async def get_current_user(request: Request):
+    with span("auth"):
+        return await _resolve_user(request)
+
+
+async def _resolve_user(request: Request):
+    # 1. Пробуем взять токен из cookie
+    token = request.cookies.get("access_token")
+
+    # 2. Если в cookie нет — пробуем из заголовка Authorization
+    if not token:
+        auth_header = request.headers.get("Authorization")
+        if auth_header and auth_header.startswith("Bearer "):
+            token = auth_header.split(" ", 1)[1]
+
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Отсутствует токен пользователя",
+        )
+
+    payload = decode_access_token_cached(token)
+    if not payload:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Недействительный токен пользователя",
+        )
+
+    user = await get_user_by_email(payload["sub"])
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    return user
+
+
+async def get_admin_user(request: Request):
+    """Как get_current_user, но только для администраторов"""
+    user = await get_current_user(request)
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Недостаточно прав")
+    return user
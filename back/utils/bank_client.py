@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import httpx
+from fastapi import HTTPException
+
+from utils.rate_limit import TokenBucket
+from utils.metrics import bank_requests, bank_endpoint
+from utils.tracing import span
+
+BANK_URLS = {
+    "vbank": "https://vbank.open.bankingapi.ru",
+    "abank": "https://abank.open.bankingapi.ru",
+    "sbank": "https://sbank.open.bankingapi.ru",
+}
+
+CLIENT_ID = os.getenv("CLIENT_ID")
+CLIENT_SECRET = os.getenv("CLIENT_SECRET")
+
+# Долгоживущие клиенты: один пул соединений на банк
+_clients: dict[str, httpx.AsyncClient] = {}
+# Ограничители частоты запросов к банку
+_limiters: dict[str, TokenBucket] = {}
+
+
+def bank_setting(bank: str, name: str, default):
+    """
+    Читает настройку клиента банка.
+    Сначала ищется BANK_<NAME>_<BANK> (например BANK_TIMEOUT_VBANK),
+    затем общая BANK_<NAME>, иначе — значение по умолчанию.
+    """
+    raw = os.getenv(f"BANK_{name}_{bank.upper()}") or os.getenv(f"BANK_{name}")
+    if raw is None or raw == "":
+        return default
+    if isinstance(default, bool):
+        return raw.lower() in ("1", "true", "yes", "on")
+    return type(default)(raw)
+
+
+def _http2_enabled(bank: str) -> bool:
+    if not bank_setting(bank, "HTTP2", False):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print(f"[{bank}] HTTP/2 requested but 'h2' is not installed, falling back to HTTP/1.1")
+        return False
+    return True
+
+
+class MeteredTransport(httpx.AsyncBaseTransport):
+    """Транспорт-обёртка: время и статус каждого запроса к банку (метрики и спаны, включая сетевые ошибки)"""
+
+    def __init__(self, bank: str, inner: httpx.AsyncBaseTransport, prefix: str = ""):
+        self.bank = bank
+        self.inner = inner
+        self.prefix = prefix.rstrip("/")
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if self.prefix and path.startswith(self.prefix):
+            path = path[len(self.prefix):]
+        endpoint = bank_endpoint(path)
+        started = time.perf_counter()
+        status = "error"
+        try:
+            with span("bank", bank=self.bank, endpoint=endpoint) as sp:
+                response = await self.inner.handle_async_request(request)
+                status = response.status_code
+                sp.set(status=status)
+            return response
+        finally:
+            bank_requests.observe(time.perf_counter() - started, bank=self.bank, endpoint=endpoint, status=status)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+def _build_client(bank: str) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=bank_setting(bank, "MAX_CONNECTIONS", 100),
+        max_keepalive_connections=bank_setting(bank, "MAX_KEEPALIVE", 20),
+        keepalive_expiry=bank_setting(bank, "KEEPALIVE_EXPIRY", 30.0),
+    )
+    timeout = httpx.Timeout(
+        bank_setting(bank, "TIMEOUT", 15.0),
+        connect=bank_setting(bank, "CONNECT_TIMEOUT", 5.0),
+        pool=bank_setting(bank, "POOL_TIMEOUT", 10.0),
+    )
+    base_url = bank_setting(bank, "URL", BANK_URLS[bank])   # BANK_URL_VBANK=... — например, локальный мок
+    transport = httpx.AsyncHTTPTransport(verify=False, trust_env=True, http2=_http2_enabled(bank), limits=limits)
+    return httpx.AsyncClient(
+        base_url=base_url,
+        trust_env=True,
+        timeout=timeout,
+        transport=MeteredTransport(bank, transport, httpx.URL(base_url).path),
+    )
+
+
+def get_bank_client(bank: str) -> httpx.AsyncClient:
+    """
+    Возвращает общий клиент банка с keep-alive пулом.
+    Если реестр ещё не открыт (например, вне приложения) — клиент создаётся лениво.
+    """
+    client = _clients.get(bank)
+    if client is None or client.is_closed:
+        client = _build_client(bank)
+        _clients[bank] = client
+    return client
+
+
+def get_bank_limiter(bank: str) -> TokenBucket:
+    """Token bucket банка: BANK_RATE запросов/сек с запасом BANK_BURST"""
+    limiter = _limiters.get(bank)
+    if limiter is None:
+        limiter = TokenBucket(
+            rate=bank_setting(bank, "RATE", 10.0),
+            burst=bank_setting(bank, "BURST", 10),
+        )
+        _limiters[bank] = limiter
+    return limiter
+
+
+def page_concurrency(bank: str) -> int:
+    """Сколько страниц транзакций банка можно качать одновременно"""
+    return max(1, bank_setting(bank, "PAGE_CONCURRENCY", 4))
+
+
+async def open_bank_clients():
+    """Создаёт клиентов для всех банков из BANK_URLS"""
+    for bank in BANK_URLS:
+        get_bank_client(bank)
+
+
+async def close_bank_clients():
+    """Закрывает все пулы соединений"""
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
+
+async def request_bank(bank: str, method: str, path: str, *, headers=None, params=None, json_body=None):
+    """Запрос к банку через общий клиент; ошибки банка превращаются в HTTPException"""
+    try:
+        client = get_bank_client(bank)
+        resp = await client.request(method, path, headers=headers, params=params, json=json_body)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=503, detail=f"Ошибка при обращении к банку: {e!s}")
+
+    if resp.status_code >= 400:
+        try:
+            detail = resp.json()
+        except Exception:
+            detail = resp.text
+        raise HTTPException(status_code=resp.status_code, detail=detail)
+
+    try:
+        return resp.json()
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=502, detail="Банк вернул не-JSON ответ")
@@ -0,0 +1,454 @@
+"""
+Сервис данных банков: счета, балансы и транзакции пользователя.
+Используется и HTTP-роутами (/accounts), и AI-чатом напрямую, без запросов к самому себе.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import httpx
+from collections import deque
+from itertools import islice
+from datetime import datetime
+from typing import AsyncIterator
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from db.db import database
+from db.models import bank_consents
+from utils.bank_tokens import get_or_refresh_token
+from utils.bank_client import BANK_URLS, CLIENT_ID, bank_setting, get_bank_client, get_bank_limiter, page_concurrency
+from utils import tx_store
+from utils.answer_cache import invalidate_user_answers
+from utils.cache import TTLCache
+
+TX_PAGE_LIMIT = 50  # можно выставить максимум, чтобы быстрее собрать всё
+TX_SYNC_TTL = int(os.getenv("TX_SYNC_TTL", "300"))  # сек, после которых делаем дельта-синхронизацию
+
+
+# ---------- Заголовки ----------
+async def bank_request_context(user_id: int, bank: str) -> tuple[dict, dict]:
+    """Токен банка + согласие пользователя → (headers, params) для запросов к банку"""
+    if bank not in BANK_URLS:
+        raise HTTPException(status_code=400, detail="Неверный банк")
+
+    bank_token = await get_or_refresh_token(user_id, bank)
+    headers = {"Authorization": f"Bearer {bank_token}"}
+    params = {}
+
+    record = await database.fetch_one(
+        select(bank_consents).where(
+            (bank_consents.c.user_id == user_id)
+            & (bank_consents.c.bank_name == bank)
+        )
+    )
+    if record:
+        consent_id = record["consent_id"]
+        client_id = record["client_id"]
+        status = (record["status"] or "").lower()
+
+        if consent_id and status in ["approved", "authorized"]:
+            headers["X-Consent-Id"] = consent_id
+            headers["X-Requesting-Bank"] = CLIENT_ID
+            if client_id:
+                params["client_id"] = client_id
+
+    return headers, params
+
+
+# ---------- Счета ----------
+async def get_accounts_with_balances(user_id: int, bank: str) -> dict:
+    """Счета пользователя в банке с балансами"""
+    headers, params = await bank_request_context(user_id, bank)
+
+    # --- Отправляем запрос в банк ---
+    client = get_bank_client(bank)
+    try:
+        resp = await client.get("/accounts", headers=headers, params=params)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=503, detail=f"Ошибка при обращении к банку: {e!s}")
+
+    # --- Обработка ошибок ---
+    if resp.status_code == 401:
+        raise HTTPException(status_code=401, detail="Банк отклонил авторизацию (401)")
+    if resp.status_code == 400 and "client_id" in resp.text.lower():
+        raise HTTPException(status_code=400, detail="client_id обязателен для межбанковского запроса")
+    if resp.status_code == 403:
+        raise HTTPException(status_code=403, detail="Согласие отсутствует или отозвано")
+    if resp.status_code != 200:
+        raise HTTPException(status_code=resp.status_code, detail=resp.text)
+
+    # --- Счета ---
+    accounts = resp.json().get("data", {}).get("account", [])
+
+    if not accounts:
+        return {"accounts": [], "message": "Счета не найдены", "bank": bank}
+
+    # --- Параллельно получаем балансы ---
+    async def fetch_balance(acc_id):
+        try:
+            r = await client.get(f"/accounts/{acc_id}/balances", headers=headers)
+            if r.status_code == 200:
+                return {"accountId": acc_id, "balance": r.json().get("data", {})}
+            else:
+                return {"accountId": acc_id, "error": f"Bank returned {r.status_code}"}
+        except Exception as e:
+            return {"accountId": acc_id, "error": str(e)}
+
+    tasks = [fetch_balance(a.get("accountId")) for a in accounts if a.get("accountId")]
+    balances = await asyncio.gather(*tasks)
+
+    # --- Объединяем счета и балансы ---
+    for acc in accounts:
+        acc_id = acc.get("accountId")
+        match = next((b for b in balances if b["accountId"] == acc_id), None)
+        if match:
+            acc["balance"] = match.get("balance") or {"error": match.get("error")}
+
+    # --- Запоминаем счета локально ---
+    await tx_store.save_accounts(user_id, bank, accounts)
+
+    return {
+        "bank": bank,
+        "accounts": accounts,
+        "count": len(accounts),
+        "fetched_at": datetime.utcnow().isoformat() + "Z",
+    }
+
+
+# ---------- Кэш счетов ----------
+ACCOUNTS_CACHE_TTL = float(os.getenv("ACCOUNTS_CACHE_TTL", "30"))                 # сек, ответ свежий
+ACCOUNTS_CACHE_STALE = float(os.getenv("ACCOUNTS_CACHE_STALE", "300"))            # ещё столько отдаём и обновляем в фоне
+ACCOUNTS_CACHE_STALE_IF_ERROR = float(os.getenv("ACCOUNTS_CACHE_STALE_IF_ERROR", "3600"))  # запас на случай сбоя банка
+
+# (user_id, bank) -> {"data", "etag", "stored_at"}
+_accounts_cache = TTLCache(
+    "accounts",
+    maxsize=int(os.getenv("ACCOUNTS_CACHE_SIZE", "5000")),
+    ttl=max(ACCOUNTS_CACHE_TTL + ACCOUNTS_CACHE_STALE, ACCOUNTS_CACHE_STALE_IF_ERROR),
+)
+_accounts_inflight: dict[tuple[int, str], asyncio.Task] = {}
+# Поколение ключа: загрузка, начатая до инвалидации, не должна записать старые данные
+_accounts_generation: dict[tuple[int, str], int] = {}
+
+
+def make_etag(data: dict) -> str:
+    """ETag по содержимому ответа (без служебного fetched_at)"""
+    body = json.dumps({k: v for k, v in data.items() if k != "fetched_at"}, sort_keys=True, ensure_ascii=False)
+    return '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+
+
+def invalidate_accounts(user_id: int, bank: str):
+    """Сбрасывает кэш счетов — вызывать при любом изменении согласия"""
+    key = (user_id, bank)
+    _accounts_cache.pop(key)
+    _accounts_generation[key] = _accounts_generation.get(key, 0) + 1
+    _accounts_inflight.pop(key, None)
+
+
+def _revalidate_accounts(user_id: int, bank: str) -> asyncio.Task:
+    """Одна загрузка на ключ, сколько бы запросов её ни ждали"""
+    key = (user_id, bank)
+    task = _accounts_inflight.get(key)
+    if task is None or task.done():
+        generation = _accounts_generation.get(key, 0)
+
+        async def load():
+            try:
+                data = await get_accounts_with_balances(user_id, bank)
+                entry = {"data": data, "etag": make_etag(data), "stored_at": time.monotonic()}
+                if _accounts_generation.get(key, 0) == generation:
+                    _accounts_cache.set(key, entry)
+                return entry
+            finally:
+                if _accounts_inflight.get(key) is asyncio.current_task():
+                    del _accounts_inflight[key]
+
+        task = asyncio.create_task(load())
+        _accounts_inflight[key] = task
+    return task
+
+
+async def get_accounts_cached(user_id: int, bank: str) -> tuple[dict, str, str, float]:
+    """
+    Счета с кэшем на (user, bank): (data, etag, статус кэша, сколько секунд ответ ещё свежий).
+    HIT — свежий ответ; STALE — устаревший, обновление уже идёт в фоне;
+    STALE-IF-ERROR — банк ответил 5xx/таймаутом, отдаём последнюю удачную версию.
+    """
+    if bank not in BANK_URLS:
+        raise HTTPException(status_code=400, detail="Неверный банк")
+
+    entry = _accounts_cache.get((user_id, bank))
+    if entry:
+        age = time.monotonic() - entry["stored_at"]
+        if age < ACCOUNTS_CACHE_TTL:
+            return entry["data"], entry["etag"], "HIT", ACCOUNTS_CACHE_TTL - age
+        if age < ACCOUNTS_CACHE_TTL + ACCOUNTS_CACHE_STALE:
+            task = _revalidate_accounts(user_id, bank)
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            return entry["data"], entry["etag"], "STALE", 0.0
+
+    try:
+        fresh = await asyncio.shield(_revalidate_accounts(user_id, bank))
+    except HTTPException as e:
+        if entry and e.status_code >= 500:
+            return entry["data"], entry["etag"], "STALE-IF-ERROR", 0.0
+        raise
+    return fresh["data"], fresh["etag"], "MISS", ACCOUNTS_CACHE_TTL
+
+
+# ---------- Все банки сразу ----------
+CONNECTED_STATUSES = ("approved", "authorized")
+# Какой баланс считать основным, если банк вернул несколько
+BALANCE_PRIORITY = ("InterimAvailable", "ClosingAvailable", "InterimBooked", "ClosingBooked")
+
+
+async def connected_banks(user_id: int) -> list[str]:
+    """Банки из BANK_URLS, по которым у пользователя есть подтверждённое согласие"""
+    records = await database.fetch_all(
+        select(bank_consents.c.bank_name, bank_consents.c.status).where(bank_consents.c.user_id == user_id)
+    )
+    connected = {r["bank_name"] for r in records if (r["status"] or "").lower() in CONNECTED_STATUSES}
+    return [bank for bank in BANK_URLS if bank in connected]
+
+
+def account_balance(acc: dict) -> tuple[float, str] | None:
+    """Основной баланс счёта как (сумма со знаком, валюта)"""
+    data = acc.get("balance") or {}
+    items = data.get("balance") if isinstance(data.get("balance"), list) else [data]
+    items = [b for b in items if isinstance(b, dict) and b.get("amount")]
+    if not items:
+        return None
+    items.sort(key=lambda b: BALANCE_PRIORITY.index(b["type"]) if b.get("type") in BALANCE_PRIORITY else len(BALANCE_PRIORITY))
+    best = items[0]
+    try:
+        amount = float(best["amount"]["amount"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if best.get("creditDebitIndicator") == "Debit":
+        amount = -amount
+    return amount, best["amount"].get("currency") or "RUB"
+
+
+async def get_all_accounts(user_id: int) -> dict:
+    """
+    Счета по всем подключённым банкам параллельно.
+    У каждого банка свой дедлайн (BANK_DEADLINE[_<BANK>]); медленный или упавший банк
+    не ломает ответ — вместо счетов у него будет запись об ошибке.
+    """
+    banks = await connected_banks(user_id)
+
+    async def fetch(bank: str) -> dict:
+        deadline = bank_setting(bank, "DEADLINE", 8.0)
+        try:
+            data, *_ = await asyncio.wait_for(get_accounts_cached(user_id, bank), timeout=deadline)
+            return data
+        except asyncio.TimeoutError:
+            return {"bank": bank, "error": f"Банк не ответил за {deadline:g} с", "status_code": 504}
+        except HTTPException as e:
+            return {"bank": bank, "error": e.detail, "status_code": e.status_code}
+        except Exception as e:
+            return {"bank": bank, "error": str(e), "status_code": 500}
+
+    results = await asyncio.gather(*(fetch(bank) for bank in banks))
+
+    accounts, errors, totals = [], [], {}
+    for result in results:
+        if "error" in result:
+            errors.append(result)
+            continue
+        for acc in result.get("accounts", []):
+            accounts.append({**acc, "bank": result["bank"]})
+            balance = account_balance(acc)
+            if balance:
+                totals[balance[1]] = totals.get(balance[1], 0.0) + balance[0]
+
+    return {
+        "banks": banks,
+        "accounts": accounts,
+        "count": len(accounts),
+        "errors": errors,
+        "partial": bool(errors),
+        "total_balance": [{"amount": f"{v:.2f}", "currency": c} for c, v in totals.items()],
+        "fetched_at": datetime.utcnow().isoformat() + "Z",
+    }
+
+
+# ---------- Транзакции ----------
+async def iter_transaction_pages(bank: str, account_id: str, headers: dict,
+                                 watermark: datetime | None = None) -> AsyncIterator[list]:
+    """
+    Отдаёт страницы транзакций счёта по мере загрузки из банка.
+    Без водяного знака — все страницы (параллельно, в окне банка, но по порядку).
+    С водяным знаком — только страницы новее последней сохранённой проводки.
+    """
+    client = get_bank_client(bank)
+    limiter = get_bank_limiter(bank)
+
+    async def fetch_page(page: int) -> list:
+        await limiter.acquire()  # чтобы не заспамить банк
+        params = {"page": page, "limit": TX_PAGE_LIMIT}
+        try:
+            resp = await client.get(f"/accounts/{account_id}/transactions", headers=headers, params=params)
+        except httpx.RequestError as e:
+            raise HTTPException(status_code=503, detail=f"Ошибка при обращении к банку: {e!s}")
+
+        if resp.status_code == 401:
+            raise HTTPException(status_code=401, detail="Банк отклонил авторизацию (401)")
+        if resp.status_code == 403:
+            raise HTTPException(status_code=403, detail="Нет согласия для доступа к транзакциям")
+        if resp.status_code != 200:
+            raise HTTPException(status_code=resp.status_code, detail=resp.text)
+        data = resp.json()
+        nonlocal total_pages
+        total_pages = data.get("meta", {}).get("totalPages", total_pages)
+        return data.get("data", {}).get("transaction", [])
+
+    # Первая страница сообщает общее количество страниц
+    total_pages = 1
+    first = await fetch_page(1)
+    if not first or total_pages <= 1:
+        yield first
+        return
+
+    if watermark is None:
+        yield first
+        # Остальные страницы — параллельно, но не больше окна банка: задача на
+        # следующую страницу создаётся, только когда освободилось место в окне.
+        # Отдаём строго по порядку, как только готова очередная
+        window = page_concurrency(bank)
+        pages = iter(range(2, total_pages + 1))
+        pending: deque[asyncio.Task] = deque()
+        try:
+            for page_no in islice(pages, window):
+                pending.append(asyncio.create_task(fetch_page(page_no)))
+            while pending:
+                page = await pending.popleft()
+                for page_no in islice(pages, 1):
+                    pending.append(asyncio.create_task(fetch_page(page_no)))
+                yield page
+        finally:
+            for task in pending:
+                task.cancel()
+            # Дожидаемся отменённых, чтобы их ошибки не всплыли как "never retrieved"
+            await asyncio.gather(*pending, return_exceptions=True)
+        return
+
+    def reached(page: list) -> bool:
+        return any(d and d <= watermark for d in map(tx_store.parse_booking_date, page))
+
+    # Дельта: идём от свежих страниц к старым, пока не встретим уже сохранённое.
+    # Порядок страниц в банке определяем по датам первой страницы.
+    dates = [d for d in map(tx_store.parse_booking_date, first) if d]
+    newest_first = not dates or dates[0] >= dates[-1]
+    if newest_first:
+        yield first
+        if reached(first):
+            return
+        order = range(2, total_pages + 1)
+    else:
+        order = range(total_pages, 1, -1)
+
+    for page_no in order:
+        page = await fetch_page(page_no)
+        yield page
+        if not page or reached(page):
+            return
+    if not newest_first:
+        yield first
+
+
+async def fetch_transaction_pages(bank: str, account_id: str, headers: dict, watermark: datetime | None = None) -> list:
+    """Все нужные страницы одним списком (см. iter_transaction_pages)"""
+    return [tx async for page in iter_transaction_pages(bank, account_id, headers, watermark) for tx in page]
+
+
+async def _sync_plan(user_id: int, bank: str, account_id: str, refresh: bool):
+    """Нужна ли синхронизация и с какого водяного знака: (нужна, watermark, synced_at)"""
+    if bank not in BANK_URLS:
+        raise HTTPException(status_code=400, detail="Неверный банк")
+
+    state = await tx_store.get_account_state(user_id, bank, account_id)
+    synced_at = state["synced_at"] if state else None
+    stale = not synced_at or (datetime.utcnow() - synced_at).total_seconds() > TX_SYNC_TTL
+    watermark = None if refresh or not state else state["last_booking_date"]
+    return refresh or stale, watermark, synced_at
+
+
+async def get_account_transactions(user_id: int, bank: str, account_id: str, refresh: bool = False) -> dict:
+    """
+    История транзакций счёта из локального хранилища.
+    Если данные устарели — докачивает из банка только новые страницы,
+    при refresh=True перекачивает всю историю.
+    """
+    need_sync, watermark, synced_at = await _sync_plan(user_id, bank, account_id, refresh)
+
+    if need_sync:
+        headers, _ = await bank_request_context(user_id, bank)
+        fetched = await fetch_transaction_pages(bank, account_id, headers, watermark)
+        await tx_store.save_transactions(user_id, bank, account_id, fetched)
+        synced_at = datetime.utcnow()
+
+    all_transactions = await tx_store.load_transactions(user_id, bank, account_id)
+
+    return {
+        "bank": bank,
+        "accountId": account_id,
+        "total": len(all_transactions),
+        "transactions": all_transactions,
+        "synced_at": synced_at.isoformat() + "Z",
+        "fetched_at": datetime.utcnow().isoformat() + "Z",
+    }
+
+
+async def stream_account_transactions(user_id: int, bank: str, account_id: str,
+                                     refresh: bool = False) -> AsyncIterator[dict]:
+    """
+    Потоковый вариант get_account_transactions: транзакции отдаются по одной,
+    страницы из банка — сразу после загрузки (и тут же пишутся в хранилище),
+    старая история — курсором из БД. Последним идёт {"summary": {...}}.
+    """
+    need_sync, watermark, synced_at = await _sync_plan(user_id, bank, account_id, refresh)
+    emitted = set()  # ключи уже отданных транзакций: страницы банка могут сдвигаться
+    from_bank_only = False
+
+    if need_sync:
+        headers, _ = await bank_request_context(user_id, bank)
+        newest = None
+        added = 0
+        async for page in iter_transaction_pages(bank, account_id, headers, watermark):
+            # Тот же замок, что у save_transactions: параллельные синхронизации не мешают друг другу
+            async with tx_store.sync_lock():
+                page_added, page_newest = await tx_store.insert_transactions(user_id, bank, account_id, page)
+            added += page_added
+            if page_newest and (newest is None or page_newest > newest):
+                newest = page_newest
+            for tx in page:
+                key = tx_store.transaction_key(tx)
+                if key not in emitted:
+                    emitted.add(key)
+                    yield tx
+        # Водяной знак двигаем только после полной загрузки, иначе оборванная
+        # синхронизация оставила бы дыру в истории
+        async with tx_store.sync_lock():
+            await tx_store.mark_synced(user_id, bank, account_id, newest)
+        if added:
+            invalidate_user_answers(user_id)
+        synced_at = datetime.utcnow()
+        from_bank_only = watermark is None
+
+    total = len(emitted)
+    if not from_bank_only:
+        async for tx in tx_store.iterate_transactions(user_id, bank, account_id):
+            if tx_store.transaction_key(tx) not in emitted:
+                total += 1
+                yield tx
+
+    yield {"summary": {
+        "bank": bank,
+        "accountId": account_id,
+        "total": total,
+        "synced_at": synced_at.isoformat() + "Z",
+        "fetched_at": datetime.utcnow().isoformat() + "Z",
+    }}
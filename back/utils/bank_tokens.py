@@ -0,0 +1,157 @@
+"""
+Токены банков. Токен выдаётся на наше приложение (CLIENT_ID/CLIENT_SECRET),
+поэтому он один на банк и общий для всех пользователей: держим его в памяти,
+обновляем заранее в фоне, а БД используем только для тёплого старта.
+"""
+import asyncio
+import random
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy import select, insert, update, and_, desc
+
+from db.db import database
+from db.models import bank_tokens
+from utils.bank_client import BANK_URLS, CLIENT_ID, CLIENT_SECRET, request_bank
+
+# За сколько до истечения токен считается «пора обновлять»
+REFRESH_MARGIN = timedelta(minutes=5)
+# Пауза перед повтором неудачного фонового обновления
+RETRY_DELAY = 30
+
+
+# ---------- DB helpers ----------
+async def load_token(bank: str):
+    """Самый свежий живой токен банка из БД (для тёплого старта)"""
+    rec = await database.fetch_one(
+        select(bank_tokens)
+        .where(
+            and_(
+                bank_tokens.c.bank_name == bank,
+                bank_tokens.c.expires_at > datetime.utcnow() + REFRESH_MARGIN,
+            )
+        )
+        .order_by(desc(bank_tokens.c.expires_at))
+    )
+    if rec:
+        return rec["access_token"], rec["expires_at"]
+    return None
+
+
+async def save_token(user_id: int, bank: str, token: str, expires_at: datetime):
+    existing = await database.fetch_one(
+        select(bank_tokens).where(
+            and_(bank_tokens.c.user_id == user_id, bank_tokens.c.bank_name == bank)
+        )
+    )
+    if existing:
+        q = (
+            update(bank_tokens)
+            .where(bank_tokens.c.id == existing["id"])
+            .values(access_token=token, expires_at=expires_at)
+        )
+    else:
+        q = insert(bank_tokens).values(
+            user_id=user_id, bank_name=bank, access_token=token, expires_at=expires_at
+        )
+    await database.execute(q)
+
+
+# ---------- Менеджер ----------
+class BankTokenManager:
+    """
+    Кэш токенов по банку с single-flight обновлением:
+    сколько бы запросов ни пришло одновременно, в банк уходит один POST /auth/bank-token.
+    """
+
+    def __init__(self):
+        self._tokens: dict[str, tuple[str, datetime]] = {}   # bank -> (token, expires_at)
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._renewers: dict[str, asyncio.Task] = {}
+        self._owners: dict[str, int] = {}                     # под каким user_id сохраняем в БД
+
+    async def get_token(self, bank: str, user_id: int) -> str:
+        self._owners[bank] = user_id
+        cached = self._tokens.get(bank)
+        now = datetime.utcnow()
+        if cached and cached[1] > now + REFRESH_MARGIN:
+            return cached[0]
+        if cached and cached[1] > now:
+            # Ещё живой — отдаём сразу, а обновление пусть идёт в фоне
+            task = self._start_refresh(bank)
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())  # ошибку увидит следующий вызов
+            return cached[0]
+        return await asyncio.shield(self._start_refresh(bank, warm_start=cached is None))
+
+    def _start_refresh(self, bank: str, warm_start: bool = False) -> asyncio.Task:
+        task = self._inflight.get(bank)
+        if task is None or task.done():
+            task = asyncio.create_task(self._refresh(bank, warm_start))
+            self._inflight[bank] = task
+        return task
+
+    async def _refresh(self, bank: str, warm_start: bool) -> str:
+        try:
+            stored = await load_token(bank) if warm_start else None
+            if stored:
+                token, expires_at = stored
+            else:
+                data = await request_bank(
+                    bank, "POST", "/auth/bank-token", params={"client_id": CLIENT_ID, "client_secret": CLIENT_SECRET}
+                )
+                token = data.get("access_token")
+                exp = int(data.get("expires_in", 86400))
+                if not token:
+                    raise HTTPException(status_code=502, detail="Банк не вернул access_token")
+                expires_at = datetime.utcnow() + timedelta(seconds=exp)
+                owner = self._owners.get(bank)
+                if owner is not None:
+                    await save_token(owner, bank, token, expires_at)
+
+            self._tokens[bank] = (token, expires_at)
+            self._schedule_renewal(bank, expires_at)
+            return token
+        finally:
+            if self._inflight.get(bank) is asyncio.current_task():
+                del self._inflight[bank]
+
+    def _schedule_renewal(self, bank: str, expires_at: datetime):
+        old = self._renewers.get(bank)
+        if old and not old.done():
+            old.cancel()
+        self._renewers[bank] = asyncio.create_task(self._renew_later(bank, expires_at))
+
+    async def _renew_later(self, bank: str, expires_at: datetime):
+        # Небольшой разброс, чтобы банки не обновлялись синхронно
+        delay = (expires_at - REFRESH_MARGIN - datetime.utcnow()).total_seconds()
+        await asyncio.sleep(max(0.0, delay - random.uniform(0, 30)))
+        while True:
+            try:
+                # shield: новый планировщик отменит этот, но не само обновление
+                await asyncio.shield(self._start_refresh(bank))
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[{bank}] background token refresh failed: {e!r}")
+                token = self._tokens.get(bank)
+                if not token or token[1] <= datetime.utcnow():
+                    return
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def close(self):
+        """Останавливает фоновые обновления (при завершении приложения)"""
+        tasks = [*self._renewers.values(), *self._inflight.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._renewers.clear()
+        self._inflight.clear()
+
+
+token_manager = BankTokenManager()
+
+
+async def get_or_refresh_token(user_id: int, bank: str):
+    if bank not in BANK_URLS:
+        raise HTTPException(status_code=400, detail="Неверный банк")
+    return await token_manager.get_token(bank, user_id)
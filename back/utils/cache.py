@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+
+# Все кэши процесса по имени — для статистики попаданий
+CACHES: dict[str, "TTLCache"] = {}
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Ограниченный in-memory кэш: LRU-вытеснение + срок жизни записи.
+    Считает попадания/промахи, чтобы было видно, работает ли кэш.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        CACHES[name] = self
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING or item[0] <= time.monotonic():
+            if item is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value, ttl: float | None = None):
+        """Кладёт значение; ttl переопределяет срок жизни по умолчанию (в секундах)"""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def cache_stats() -> dict:
+    """Статистика всех кэшей процесса"""
+    return {name: cache.stats() for name, cache in CACHES.items()}
@@ -0,0 +1,223 @@
+"""
+Память чата в пределах сессии.
+
+В промпт идут последние CHAT_HISTORY_TURNS пар реплик дословно и сводка
+всего, что было раньше. Сводка хранится в ai_chat_summaries (одна на сессию)
+и пересобирается лениво: когда между ней и дословным окном накопилось
+CHAT_SUMMARY_EVERY сообщений, после ответа в фоне старая сводка + эти
+сообщения сжимаются моделью в новую. Запрос пользователя её не ждёт.
+
+Весь промпт (память + контекст расходов + вопрос) укладывается в жёсткий
+бюджет CHAT_PROMPT_TOKENS: сводка обрезается, старые реплики отбрасываются.
+"""
+import os
+import asyncio
+from datetime import datetime
+from sqlalchemy import select, insert, update, and_, desc, asc, func
+
+from db.db import database
+from db.models import ai_chat, ai_chat_summaries
+from utils.llm import CHARS_PER_TOKEN, estimate_tokens, summarize_dialog
+from utils.metrics import llm_prompt_tokens, chat_memory_dropped, chat_summaries
+
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "4"))
+CHAT_PROMPT_TOKENS = int(os.getenv("CHAT_PROMPT_TOKENS", "2000"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+CHAT_SUMMARY_EVERY = int(os.getenv("CHAT_SUMMARY_EVERY", "6"))
+# Одна длинная реплика (обычно ответ модели) не должна съедать весь бюджет
+CHAT_MESSAGE_TOKENS = int(os.getenv("CHAT_MESSAGE_TOKENS", "400"))
+# Сколько сообщений сворачивать в сводку за один вызов модели
+SUMMARY_FOLD_MAX = 50
+# Служебные токены на каждое сообщение (роль, разделители)
+MESSAGE_OVERHEAD = 4
+
+# (user_id, session_id) -> фоновая пересборка сводки
+_summaries_inflight: dict[tuple, asyncio.Task] = {}
+
+
+class ChatMemory:
+    """Память, уже уложенная в бюджет: сводка + последние реплики"""
+
+    def __init__(self, session_id: str | None, summary: str, turns: list[dict], dropped: int, stale: bool):
+        self.session_id = session_id
+        self.summary = summary
+        self.turns = turns        # [{"role", "content"}], от старых к новым
+        self.dropped = dropped    # реплик окна, не вошедших в бюджет
+        self.stale = stale        # пора пересобрать сводку
+
+    def messages(self) -> list[dict]:
+        head = [{"role": "system", "content": f"Краткое содержание предыдущей части разговора:\n{self.summary}"}] \
+            if self.summary else []
+        return head + self.turns
+
+    @property
+    def summary_tokens(self) -> int:
+        return estimate_tokens(self.summary) + MESSAGE_OVERHEAD if self.summary else 0
+
+    @property
+    def history_tokens(self) -> int:
+        return sum(estimate_tokens(t["content"]) + MESSAGE_OVERHEAD for t in self.turns)
+
+
+def clip(text: str, tokens: int) -> str:
+    """Обрезает текст до примерно tokens токенов"""
+    limit = max(0, int(tokens * CHARS_PER_TOKEN))
+    if len(text) <= limit:
+        return text
+    return text[:max(0, limit - 1)].rstrip() + "…"
+
+
+def _session_filter(user_id: int, session_id: str | None):
+    c = ai_chat.c
+    return and_(c.user_id == user_id, c.session_id == session_id if session_id else c.session_id.is_(None))
+
+
+async def _summary_row(user_id: int, session_id: str | None):
+    return await database.fetch_one(
+        select(ai_chat_summaries).where(and_(
+            ai_chat_summaries.c.user_id == user_id,
+            ai_chat_summaries.c.session_id == (session_id or ""),
+        ))
+    )
+
+
+async def _window(user_id: int, session_id: str | None) -> list:
+    """
+    Последние CHAT_HISTORY_TURNS пар сессии, от старых к новым.
+    Вопросы без ответа в конце (ещё генерируются, двойной клик) не берём.
+    """
+    rows = await database.fetch_all(
+        select(ai_chat.c.id, ai_chat.c.role, ai_chat.c.message)
+        .where(_session_filter(user_id, session_id))
+        .order_by(desc(ai_chat.c.created_at), desc(ai_chat.c.id))
+        .limit(CHAT_HISTORY_TURNS * 2 + 2)
+    )
+    rows = list(reversed(rows))
+    while rows and rows[-1]["role"] != "assistant":
+        rows.pop()
+    return rows[-CHAT_HISTORY_TURNS * 2:] if CHAT_HISTORY_TURNS > 0 else []
+
+
+async def load_memory(user_id: int, session_id: str | None, budget: int) -> ChatMemory:
+    """Память сессии в пределах budget токенов: сначала сводка, затем реплики от новых к старым"""
+    window = await _window(user_id, session_id)
+    record = await _summary_row(user_id, session_id)
+    covered = record["covered_until"] if record else 0
+
+    # Сообщения между сводкой и окном в промпт не попадают — их пора свернуть
+    boundary = window[0]["id"] if window else None
+    stale = False
+    if boundary is not None:
+        pending = await database.fetch_val(
+            select(func.count()).select_from(ai_chat).where(and_(
+                _session_filter(user_id, session_id),
+                ai_chat.c.id > covered,
+                ai_chat.c.id < boundary,
+            ))
+        )
+        stale = (pending or 0) >= CHAT_SUMMARY_EVERY
+
+    summary = ""
+    if record and budget > MESSAGE_OVERHEAD:
+        summary = clip(record["summary"], min(CHAT_SUMMARY_TOKENS, budget - MESSAGE_OVERHEAD))
+        budget -= estimate_tokens(summary) + MESSAGE_OVERHEAD
+
+    turns = []
+    for r in reversed(window):
+        content = clip(r["message"], CHAT_MESSAGE_TOKENS)
+        cost = estimate_tokens(content) + MESSAGE_OVERHEAD
+        if cost > budget:
+            break
+        budget -= cost
+        turns.append({"role": r["role"], "content": content})
+    turns.reverse()
+    # История начинается с вопроса пользователя, а не с середины пары
+    while turns and turns[0]["role"] != "user":
+        turns.pop(0)
+
+    return ChatMemory(session_id, summary, turns, len(window) - len(turns), stale)
+
+
+def record_prompt_size(memory: ChatMemory, question_tokens: int, context_tokens: int, total: int):
+    llm_prompt_tokens.observe(question_tokens, part="question")
+    llm_prompt_tokens.observe(context_tokens, part="context")
+    llm_prompt_tokens.observe(memory.summary_tokens, part="summary")
+    llm_prompt_tokens.observe(memory.history_tokens, part="history")
+    llm_prompt_tokens.observe(total, part="total")
+    if memory.dropped:
+        chat_memory_dropped.inc(memory.dropped)
+
+
+# ---------- Пересборка сводки ----------
+async def refresh_summary(user_id: int, session_id: str | None):
+    """Сворачивает в сводку сообщения между текущей сводкой и дословным окном"""
+    record = await _summary_row(user_id, session_id)
+    covered = record["covered_until"] if record else 0
+    previous = record["summary"] if record else ""
+    window = await _window(user_id, session_id)
+    if not window:
+        return
+
+    rows = await database.fetch_all(
+        select(ai_chat.c.id, ai_chat.c.role, ai_chat.c.message)
+        .where(and_(
+            _session_filter(user_id, session_id),
+            ai_chat.c.id > covered,
+            ai_chat.c.id < window[0]["id"],
+        ))
+        .order_by(asc(ai_chat.c.id))
+        .limit(SUMMARY_FOLD_MAX)
+    )
+    # Вызов суммаризации тоже укладываем в бюджет промпта
+    budget = CHAT_PROMPT_TOKENS - estimate_tokens(previous) - CHAT_SUMMARY_TOKENS
+    folded = []
+    for r in rows:
+        content = clip(r["message"], CHAT_MESSAGE_TOKENS)
+        budget -= estimate_tokens(content) + MESSAGE_OVERHEAD
+        if budget < 0 and folded:
+            break
+        folded.append({"id": r["id"], "role": r["role"], "content": content})
+    if not folded:
+        return
+
+    text = await summarize_dialog(previous, folded, CHAT_SUMMARY_TOKENS)
+    if text is None:
+        chat_summaries.inc(outcome="error")
+        return
+    values = {"summary": clip(text, CHAT_SUMMARY_TOKENS), "covered_until": folded[-1]["id"],
+              "updated_at": datetime.utcnow()}
+    if record:
+        await database.execute(
+            update(ai_chat_summaries).where(ai_chat_summaries.c.id == record["id"]).values(**values)
+        )
+    else:
+        await database.execute(
+            insert(ai_chat_summaries).values(user_id=user_id, session_id=session_id or "", **values)
+        )
+    chat_summaries.inc(outcome="ok")
+
+
+async def _refresh_logged(user_id: int, session_id: str | None):
+    try:
+        await refresh_summary(user_id, session_id)
+    except Exception as e:
+        chat_summaries.inc(outcome="error")
+        print(f"Chat summary for user {user_id} session {session_id!r} failed: {e!r}")
+
+
+def schedule_summary(user_id: int, session_id: str | None):
+    """Пересобрать сводку в фоне (не чаще одной пересборки на сессию одновременно)"""
+    key = (user_id, session_id or "")
+    if key in _summaries_inflight:
+        return
+    task = asyncio.create_task(_refresh_logged(user_id, session_id))
+    _summaries_inflight[key] = task
+    task.add_done_callback(lambda t: _summaries_inflight.pop(key, None))
+
+
+async def stop_summaries():
+    """Остановка приложения: дожидаться фоновых сводок не нужно"""
+    tasks = list(_summaries_inflight.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
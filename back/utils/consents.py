@@ -0,0 +1,210 @@
+"""
+Статусы согласий банков.
+
+Раньше каждый GET /banks/{bank}/status ходил в банк, а фронт опрашивает его
+в цикле, пока пользователь подтверждает согласие. Теперь статус сверяет
+фоновый опросчик: пачкой берёт неподтверждённые согласия из bank_consents и
+проверяет каждое не чаще, чем позволяет его возраст (свежие — раз в несколько
+секунд, зависшие — всё реже). Ручки статуса читают только БД.
+"""
+import os
+import asyncio
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy import select, update, and_, or_, func
+
+from db.db import database, read_database
+from db.models import bank_consents
+from utils.bank_client import BANK_URLS, CLIENT_ID, request_bank
+from utils.bank_tokens import get_or_refresh_token
+from utils.bank_data import CONNECTED_STATUSES, invalidate_accounts
+
+# Сравниваем в нижнем регистре: банки пишут и "pending", и "AwaitingAuthorization"
+PENDING_STATUSES = ("pending", "awaitingauthorization")
+
+# Как часто опросчик просыпается
+POLL_TICK = float(os.getenv("CONSENT_POLL_TICK", "5"))
+# Интервал проверки одного согласия: возраст / POLL_AGE_FACTOR в пределах [MIN, MAX]
+POLL_MIN = float(os.getenv("CONSENT_POLL_MIN", "5"))
+POLL_MAX = float(os.getenv("CONSENT_POLL_MAX", "900"))
+POLL_AGE_FACTOR = float(os.getenv("CONSENT_POLL_AGE_FACTOR", "10"))
+# Подтверждённые согласия перепроверяем редко — чтобы заметить отзыв со стороны банка
+RECHECK_CONNECTED = float(os.getenv("CONSENT_RECHECK_CONNECTED", "1800"))
+# Сколько согласий за один проход и сколько запросов в банки одновременно
+POLL_BATCH = int(os.getenv("CONSENT_POLL_BATCH", "200"))
+POLL_CONCURRENCY = int(os.getenv("CONSENT_POLL_CONCURRENCY", "5"))
+
+
+def is_connected(status: str | None) -> bool:
+    return (status or "").lower() in CONNECTED_STATUSES
+
+
+def check_interval(record, now: datetime) -> float:
+    """Через сколько секунд после прошлой проверки согласие пора сверить снова"""
+    if is_connected(record["status"]):
+        return RECHECK_CONNECTED
+    age = (now - (record["created_at"] or now)).total_seconds()
+    return min(POLL_MAX, max(POLL_MIN, age / POLL_AGE_FACTOR))
+
+
+def is_due(record, now: datetime) -> bool:
+    checked_at = record["checked_at"]
+    if checked_at is None:
+        return True
+    return (now - checked_at).total_seconds() >= check_interval(record, now)
+
+
+def status_payload(bank: str, record) -> dict:
+    """Ответ ручки статуса по строке из bank_consents (или её отсутствию)"""
+    if not record:
+        return {"bank": bank, "status": "not_connected", "connected": False}
+    return {
+        "bank": bank,
+        "status": record["status"],
+        "req_id": record["req_id"],
+        "consent_id": record["consent_id"] or record["req_id"],
+        "connected": is_connected(record["status"]),
+        "checked_at": record["checked_at"].isoformat() if record["checked_at"] else None,
+    }
+
+
+async def get_consents(user_id: int) -> dict:
+    """Согласия пользователя по всем банкам одним запросом: bank -> строка"""
+    rows = await read_database.fetch_all(select(bank_consents).where(bank_consents.c.user_id == user_id))
+    return {r["bank_name"]: r for r in rows}
+
+
+async def sync_consent(record) -> dict:
+    """
+    Сверяет согласие с банком и приводит строку в БД к его статусу:
+    отозванное/отклонённое удаляется, изменившееся обновляется.
+    Возвращает ответ в формате ручки статуса.
+    """
+    user_id, bank = record["user_id"], record["bank_name"]
+    consent_id = record["consent_id"] or record["req_id"]
+    token = await get_or_refresh_token(user_id, bank)
+    headers = {"Authorization": f"Bearer {token}", "X-Requesting-Bank": CLIENT_ID}
+
+    try:
+        resp = await request_bank(bank, "GET", f"/account-consents/{consent_id}", headers=headers)
+    except HTTPException as e:
+        if e.status_code != 404:
+            raise
+        await database.execute(bank_consents.delete().where(bank_consents.c.id == record["id"]))
+        invalidate_accounts(user_id, bank)
+        return {
+            "bank": bank,
+            "status": "revoked",
+            "connected": False,
+            "message": "Согласие отозвано (404) и удалено локально",
+        }
+
+    data = resp.get("data", {})
+    new_status = data.get("status", record["status"])
+    new_consent_id = data.get("consentId", consent_id)
+
+    if new_status.lower() in ["revoked", "rejected"]:
+        await database.execute(bank_consents.delete().where(bank_consents.c.id == record["id"]))
+        invalidate_accounts(user_id, bank)
+        return {
+            "bank": bank,
+            "status": new_status,
+            "connected": False,
+            "message": f"Согласие {new_status.lower()} и удалено из базы",
+        }
+
+    now = datetime.utcnow()
+    await database.execute(
+        update(bank_consents)
+        .where(bank_consents.c.id == record["id"])
+        .values(status=new_status, consent_id=new_consent_id, checked_at=now)
+    )
+    if new_status != record["status"] or new_consent_id != consent_id:
+        invalidate_accounts(user_id, bank)
+
+    return status_payload(bank, {
+        **dict(record._mapping),
+        "status": new_status,
+        "consent_id": new_consent_id,
+        "checked_at": now,
+    })
+
+
+# ---------- Фоновый опросчик ----------
+class ConsentPoller:
+    """Периодически сверяет с банками согласия, у которых подошёл срок проверки"""
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self._semaphore = asyncio.Semaphore(POLL_CONCURRENCY)
+
+    async def poll_once(self) -> int:
+        """Один проход: сверяет все просроченные согласия, возвращает их число"""
+        now = datetime.utcnow()
+        checked = bank_consents.c.checked_at
+        status = func.lower(bank_consents.c.status)
+        # Грубый отбор в SQL (минимальные интервалы), точный по возрасту — в is_due
+        rows = await database.fetch_all(
+            select(bank_consents)
+            .where(bank_consents.c.bank_name.in_(list(BANK_URLS)))
+            .where(or_(
+                checked.is_(None),
+                and_(status.in_(PENDING_STATUSES),
+                     checked <= now - timedelta(seconds=POLL_MIN)),
+                and_(status.in_(CONNECTED_STATUSES),
+                     checked <= now - timedelta(seconds=RECHECK_CONNECTED)),
+            ))
+            .where(status.in_([*PENDING_STATUSES, *CONNECTED_STATUSES]))
+            .order_by(checked.is_(None).desc(), checked)
+            .limit(POLL_BATCH)
+        )
+        due = [r for r in rows if is_due(r, now)]
+        if not due:
+            return 0
+
+        # Сразу отмечаем проверку — одним условным UPDATE ... RETURNING, это и есть захват:
+        # строку, которую соседний воркер уже отметил (checked_at свежее POLL_MIN),
+        # условие не пропустит, и проверяем только то, что вернулось нам.
+        # Заодно упавшее на банке согласие не будет долбиться каждый тик
+        claimed = await database.fetch_all(
+            update(bank_consents)
+            .where(bank_consents.c.id.in_([r["id"] for r in due]))
+            .where(or_(checked.is_(None),
+                       checked <= now - timedelta(seconds=min(POLL_MIN, RECHECK_CONNECTED))))
+            .values(checked_at=now)
+            .returning(bank_consents.c.id)
+        )
+        ours = {r["id"] for r in claimed}
+        due = [r for r in due if r["id"] in ours]
+        await asyncio.gather(*(self._check(r) for r in due))
+        return len(due)
+
+    async def _check(self, record):
+        async with self._semaphore:
+            try:
+                await sync_consent(record)
+            except Exception as e:
+                print(f"[{record['bank_name']}] consent {record['id']} status check failed: {e!r}")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Consent poller pass failed: {e!r}")
+            await asyncio.sleep(POLL_TICK)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+consent_poller = ConsentPoller()
@@ -1,19 +1,49 @@
 from fastapi import FastAPI
-from db.db import database, engine, metadata
+from db.db import database, read_database, engine, metadata
+from db.config import describe
+from db.migrations import run_migrations
+from utils.bank_client import open_bank_clients, close_bank_clients
+from utils.bank_tokens import token_manager
+from utils.consents import consent_poller
+from utils.passwords import password_pool
+from utils.chat_memory import stop_summaries
+from utils.llm_gateway import llm_gateway
 
 def attach_db_events(app: FastAPI):
     """Привязывает события подключения/отключения к БД"""
     
     @app.on_event("startup")
     async def startup():
-        # Подключаемся к БД
+        # Подключаемся к БД (и к реплике для чтения, если она задана)
         await database.connect()
+        print(f"Database: {describe(str(database.url))}")
+        if read_database is not database:
+            await read_database.connect()
+            print(f"Read replica: {describe(str(read_database.url))}")
         # Создаём таблицы, если их нет
         async with engine.begin() as conn:
             await conn.run_sync(metadata.create_all)
+        # Накатываем миграции схемы (индексы и ограничения для существующих БД)
+        async with engine.begin() as conn:
+            await conn.run_sync(run_migrations)
         print("Database connected and tables ensured.")
+        # Открываем пулы соединений к банкам
+        await open_bank_clients()
+        print("Bank HTTP clients opened.")
+        # Клиент LLM-провайдера (пул соединений шлюза)
+        await llm_gateway.open()
+        # Фоновая сверка статусов согласий с банками
+        consent_poller.start()
 
     @app.on_event("shutdown")
     async def shutdown():
+        await consent_poller.stop()
+        await stop_summaries()
+        await token_manager.close()
+        await close_bank_clients()
+        await llm_gateway.close()
+        password_pool.shutdown()
+        if read_database is not database:
+            await read_database.disconnect()
         await database.disconnect()
         print("Database disconnected.")
@@ -1,34 +1,124 @@
 import os
-import httpx
-from openai import AsyncOpenAI
+import json
+import asyncio
+import hashlib
+from typing import AsyncIterator
 
-http_client = httpx.AsyncClient(timeout=30.0, verify=False)
+from utils.answer_cache import answer_key, get_answer, put_answer
+from utils.llm_gateway import AI_MODELS, LLMUnavailable, llm_gateway
 
-API_LLM = os.getenv("AI_KEY","")
+# Основная модель; запасные — в AI_MODELS после неё
+MODEL = AI_MODELS[0]
+FALLBACK_REPLY = "Извини, не удалось получить ответ от AI. Попробуй позже 🙏"
+# Грубая оценка для бюджета промпта: русский текст — около 3 символов на токен
+CHARS_PER_TOKEN = float(os.getenv("LLM_CHARS_PER_TOKEN", "3"))
 
-client = AsyncOpenAI(
-    api_key=API_LLM,
-    base_url="https://api.intelligence.io.solutions/api/v1/",
-    http_client=http_client,
+PROMPT_TEMPLATE = (
+    "Ты — финансовый помощник. Пользователь спрашивает: {question}\n\n"
+    "Вот краткий контекст по его расходам:\n{context}, добавь смайлики туда, где уместно."
 )
+# Входит в ключ кэша ответов: поменяли шаблон — старые ответы не используются
+PROMPT_FINGERPRINT = hashlib.sha256(PROMPT_TEMPLATE.encode()).hexdigest()[:16]
 
-async def ask_ai(user_message: str, context: str = "") -> str:
+# Одинаковые вопросы, пришедшие одновременно (двойной клик), ждут один запрос к модели
+_answers_inflight: dict[str, asyncio.Task] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов без токенизатора модели (с запасом вверх)"""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def build_messages(user_message: str, context: str = "", history: list[dict] | None = None) -> list[dict]:
     """
-    Отправляет сообщение в AI-модель и возвращает ответ.
-    context — необязательный текст (например, аналитика расходов).
+    Собирает промпт для модели из вопроса и контекста расходов.
+    history — уже уложенная в бюджет память диалога (сводка + последние реплики).
     """
+    prompt = PROMPT_TEMPLATE.format(question=user_message, context=context)
+    return [*(history or []), {"role": "user", "content": prompt}]
+
+
+def history_digest(history: list[dict] | None) -> str:
+    """Отпечаток памяти, которая реально уходит в промпт (сводка + дословные реплики)"""
+    if not history:
+        return ""
+    payload = json.dumps([[m["role"], m["content"]] for m in history], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cache_key(user_id: int, user_message: str, context: str = "", history: list[dict] | None = None) -> str:
+    """
+    Ключ кэша ответов: вопрос + контекст расходов + отпечаток истории из промпта.
+    Уточнение вроде «а подробнее?» зависит от предыдущих реплик, поэтому тот же
+    вопрос в другом месте диалога — другой ключ. Вопрос без истории (начало
+    сессии) попадает в кэш как раньше.
+    """
+    digest = history_digest(history)
+    if digest:
+        context = context + "\nhistory:" + digest
+    return answer_key(user_id, user_message, MODEL, PROMPT_FINGERPRINT, context)
+
+
+async def ask_ai(user_message: str, context: str = "", history: list[dict] | None = None) -> str:
+    """
+    Отправляет сообщение в AI-модель (через шлюз с очередью, повторами и
+    запасными моделями) и возвращает ответ.
+    context — необязательный текст (например, аналитика расходов),
+    history — предыдущие сообщения диалога.
+    """
+    try:
+        reply = await llm_gateway.complete(build_messages(user_message, context, history), temperature=0.8)
+    except LLMUnavailable:
+        return FALLBACK_REPLY
+    return reply.strip() or FALLBACK_REPLY
+
+
+async def ask_ai_cached(user_id: int, user_message: str, context: str = "", bypass: bool = False,
+                        history: list[dict] | None = None) -> tuple[str, bool]:
+    """
+    ask_ai через кэш ответов. Возвращает (ответ, взят ли из кэша).
+    bypass=True идёт в модель в любом случае, но свежий ответ кладёт в кэш.
+    """
+    key = cache_key(user_id, user_message, context, history)
+    if not bypass:
+        cached = get_answer(key)
+        if cached is not None:
+            return cached, True
+
+    task = _answers_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(ask_ai(user_message, context, history))
+        _answers_inflight[key] = task
+        task.add_done_callback(lambda t: _answers_inflight.pop(key) if _answers_inflight.get(key) is t else None)
+    reply = await asyncio.shield(task)
+    if reply != FALLBACK_REPLY:
+        put_answer(key, reply)
+    return reply, False
+
+
+def ask_ai_stream(user_message: str, context: str = "", history: list[dict] | None = None) -> AsyncIterator[str]:
+    """
+    Потоковый вариант ask_ai: отдаёт куски ответа по мере генерации.
+    При закрытии генератора (например, клиент ушёл) поток к провайдеру закрывается.
+    """
+    return llm_gateway.stream(build_messages(user_message, context, history), temperature=0.8)
+
+
+SUMMARY_PROMPT = (
+    "Ниже — сводка начала разговора пользователя с финансовым помощником и его продолжение. "
+    "Сожми всё в одну сводку до {limit} слов: факты о пользователе, его цели, вопросы и "
+    "данные ему советы. Без вступлений, только сводка.\n\n"
+    "Сводка:\n{summary}\n\nПродолжение:\n{dialog}"
+)
+
+
+async def summarize_dialog(summary: str, messages: list[dict], max_tokens: int) -> str | None:
+    """Новая сводка диалога = старая сводка + messages. None, если модель не ответила."""
+    dialog = "\n".join(f"{'Пользователь' if m['role'] == 'user' else 'Помощник'}: {m['content']}" for m in messages)
+    prompt = SUMMARY_PROMPT.format(limit=int(max_tokens * CHARS_PER_TOKEN / 7), summary=summary or "—", dialog=dialog)
     try:
-        prompt = (
-            f"Ты — финансовый помощник. Пользователь спрашивает: {user_message}\n\n"
-            f"Вот краткий контекст по его расходам:\n{context}, добавь смайлики туда, где уместно."
-        )
-
-        response = await client.chat.completions.create(
-            model="meta-llama/Llama-3.3-70B-Instruct",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.8,
-        )
-
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return "Извини, не удалось получить ответ от AI. Попробуй позже 🙏"
+        text = await llm_gateway.complete([{"role": "user", "content": prompt}], mode="summary",
+                                          temperature=0.2, max_tokens=max_tokens)
+    except LLMUnavailable:
+        return None
+    return text.strip() or None
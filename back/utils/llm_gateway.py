@@ -0,0 +1,330 @@
+"""
+Шлюз к LLM-провайдеру.
+
+Все обращения к модели идут через один объект:
+- не больше LLM_MAX_IN_FLIGHT запросов одновременно, остальные ждут в очереди
+  длиной до LLM_QUEUE_LIMIT (сверху — сразу отказ, а не лавина 429 у провайдера);
+- у каждой попытки свой дедлайн LLM_ATTEMPT_TIMEOUT, у всего вызова — LLM_TOTAL_TIMEOUT;
+- на 429/5xx/таймаут/обрыв — повтор с экспоненциальной задержкой и джиттером
+  (Retry-After провайдера учитывается), после LLM_RETRIES повторов — следующая
+  модель из списка AI_MODELS; 404/422 (модель недоступна или не принимает
+  параметры) — сразу следующая модель, прочие 4xx — сразу отказ;
+- если ответ не пришёл за LLM_HEDGE_AFTER секунд и есть свободный слот,
+  параллельно уходит дублирующий запрос, берётся первый ответ.
+
+Потоковые ответы повторяются только до первого куска текста, без хеджирования.
+HTTP-клиент создаётся при старте приложения (open), а не при импорте модуля.
+"""
+import os
+import time
+import random
+import asyncio
+import httpx
+import openai
+from typing import AsyncIterator
+from openai import AsyncOpenAI
+
+from utils.metrics import llm_requests, llm_failures, llm_queue_wait
+from utils.tracing import span
+
+# Основная модель и запасные по порядку: AI_MODELS=model-a,model-b
+AI_MODELS = [m.strip() for m in os.getenv(
+    "AI_MODELS", "meta-llama/Llama-3.3-70B-Instruct,meta-llama/Llama-3.1-8B-Instruct"
+).split(",") if m.strip()]
+AI_BASE_URL = os.getenv("AI_BASE_URL", "https://api.intelligence.io.solutions/api/v1/")
+AI_VERIFY_SSL = os.getenv("AI_VERIFY_SSL", "1").lower() in ("1", "true", "yes", "on")
+
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_QUEUE_LIMIT = int(os.getenv("LLM_QUEUE_LIMIT", "64"))
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "20"))
+LLM_TOTAL_TIMEOUT = float(os.getenv("LLM_TOTAL_TIMEOUT", "45"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF = float(os.getenv("LLM_BACKOFF", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "5"))
+# 0 — без хеджирования
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "8"))
+
+
+class LLMUnavailable(Exception):
+    """Ни одна модель не ответила (или очередь переполнена) — показываем запасной ответ"""
+
+
+class LLMOverloaded(LLMUnavailable):
+    pass
+
+
+def _status(e: Exception) -> int | None:
+    return getattr(e, "status_code", None)
+
+
+def _retryable(e: Exception) -> bool:
+    """Повторяем только то, что может пройти со второй попытки"""
+    if isinstance(e, (asyncio.TimeoutError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    status = _status(e)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+
+def _rejected(e: Exception) -> bool:
+    """Ошибка самого запроса (400/401/403...): другая модель её не исправит"""
+    status = _status(e)
+    return status is not None and 400 <= status < 500 and status not in (404, 422) and not _retryable(e)
+
+
+def _reason(e: Exception) -> str:
+    status = _status(e)
+    return f"http_{status}" if status else type(e).__name__
+
+
+def _retry_after(e: Exception) -> float:
+    response = getattr(e, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except ValueError:
+        return 0.0
+
+
+def backoff_delay(attempt: int, retry_after: float = 0.0) -> float:
+    """Экспонента с полным джиттером, но не раньше, чем просит провайдер"""
+    return max(retry_after, random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF * 2 ** attempt)))
+
+
+class LLMGateway:
+    def __init__(self, models: list[str], max_in_flight: int, queue_limit: int):
+        self.models = models
+        self.max_in_flight = max_in_flight
+        self.queue_limit = queue_limit
+        self.client: AsyncOpenAI | None = None
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.queued = 0
+        self.in_flight = 0
+        self.max_queued = 0
+        self.rejected = 0
+        self.hedged = 0
+
+    # ---------- Клиент ----------
+    def _build_client(self) -> AsyncOpenAI:
+        http_client = httpx.AsyncClient(
+            verify=AI_VERIFY_SSL,
+            timeout=httpx.Timeout(LLM_ATTEMPT_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(max_connections=self.max_in_flight * 2, max_keepalive_connections=self.max_in_flight),
+        )
+        # Повторы делает шлюз, у SDK свои отключены
+        return AsyncOpenAI(api_key=os.getenv("AI_KEY", ""), base_url=AI_BASE_URL,
+                           http_client=http_client, max_retries=0)
+
+    def get_client(self) -> AsyncOpenAI:
+        if self.client is None:
+            self.client = self._build_client()
+        return self.client
+
+    async def open(self):
+        self.get_client()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    # ---------- Очередь ----------
+    async def _acquire(self, deadline: float):
+        if not self._slots.locked():
+            # Свободный слот есть — без очереди (acquire не уступает управление)
+            await self._slots.acquire()
+            self.in_flight += 1
+            return
+        if self.queued >= self.queue_limit:
+            self.rejected += 1
+            llm_failures.inc(model="-", reason="overloaded")
+            raise LLMOverloaded("LLM queue is full")
+
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        enqueued = time.perf_counter()
+        acquired = False
+        try:
+            async with asyncio.timeout(max(0.0, deadline - time.monotonic())):
+                await self._slots.acquire()
+                acquired = True
+        except asyncio.TimeoutError:
+            # Таймер сработал, когда слот уже выдан, — возвращаем его, а не теряем
+            if acquired:
+                self._slots.release()
+            llm_failures.inc(model="-", reason="queue_timeout")
+            raise LLMOverloaded("LLM queue wait timed out")
+        finally:
+            self.queued -= 1
+            llm_queue_wait.observe(time.perf_counter() - enqueued)
+        self.in_flight += 1
+
+    async def _try_acquire(self) -> bool:
+        """Слот для хеджа — только если он свободен прямо сейчас и никто не ждёт"""
+        if self.queued or self._slots.locked():
+            return False
+        # Семафор не занят — acquire завершится без ожидания
+        await self._slots.acquire()
+        self.in_flight += 1
+        return True
+
+    def _release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    # ---------- Одна попытка ----------
+    async def _attempt(self, model: str, mode: str, messages: list[dict], timeout: float, **params) -> str:
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with span("llm", model=model, mode=mode) as sp:
+                response = await asyncio.wait_for(
+                    self.get_client().chat.completions.create(model=model, messages=messages, **params),
+                    timeout,
+                )
+                text = response.choices[0].message.content or ""
+                outcome = "ok"
+                sp.set(outcome=outcome)
+                return text
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            llm_failures.inc(model=model, reason=_reason(e))
+            raise
+        finally:
+            llm_requests.observe(time.perf_counter() - started, model=model, mode=mode, outcome=outcome)
+
+    async def _hedged(self, model: str, mode: str, messages: list[dict], deadline: float, **params) -> str:
+        """Попытка с дублем: если основная медлит дольше LLM_HEDGE_AFTER, уходит вторая"""
+        timeout = min(LLM_ATTEMPT_TIMEOUT, deadline - time.monotonic())
+        if not LLM_HEDGE_AFTER or LLM_HEDGE_AFTER >= timeout:
+            return await self._attempt(model, mode, messages, timeout, **params)
+
+        primary = asyncio.create_task(self._attempt(model, mode, messages, timeout, **params))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=LLM_HEDGE_AFTER)
+            if done or not await self._try_acquire():
+                return await primary
+
+            self.hedged += 1
+            hedge = asyncio.create_task(self._attempt(
+                model, "hedge", messages, min(LLM_ATTEMPT_TIMEOUT, deadline - time.monotonic()), **params,
+            ))
+            hedge.add_done_callback(lambda _: self._release())
+            tasks.add(hedge)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            # Обе упали — отдаём ошибку основной попытки
+            return primary.result()
+        finally:
+            # Проигравший дубль (или всё, если нас отменили) больше не нужен
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    # ---------- Вызовы ----------
+    async def complete(self, messages: list[dict], mode: str = "sync", **params) -> str:
+        """Ответ модели целиком; LLMUnavailable, если не ответила ни одна модель"""
+        deadline = time.monotonic() + LLM_TOTAL_TIMEOUT
+        await self._acquire(deadline)
+        try:
+            last_error = None
+            for model in self.models:
+                for attempt in range(LLM_RETRIES + 1):
+                    if time.monotonic() >= deadline:
+                        raise LLMUnavailable("LLM deadline exceeded") from last_error
+                    try:
+                        return await self._hedged(model, mode, messages, deadline, **params)
+                    except Exception as e:
+                        last_error = e
+                        if _rejected(e):
+                            raise LLMUnavailable(f"LLM request rejected: {_reason(e)}") from e
+                        if not _retryable(e) or attempt == LLM_RETRIES:
+                            break
+                        delay = backoff_delay(attempt, _retry_after(e))
+                        if time.monotonic() + delay >= deadline:
+                            break
+                        await asyncio.sleep(delay)
+            raise LLMUnavailable("all LLM models failed") from last_error
+        finally:
+            self._release()
+
+    async def _open_stream(self, messages: list[dict], deadline: float, **params):
+        """Открывает поток у первой ответившей модели: (модель, поток, время начала)"""
+        last_error = None
+        for model in self.models:
+            for attempt in range(LLM_RETRIES + 1):
+                timeout = min(LLM_ATTEMPT_TIMEOUT, deadline - time.monotonic())
+                if timeout <= 0:
+                    raise LLMUnavailable("LLM deadline exceeded") from last_error
+                started = time.perf_counter()
+                try:
+                    stream = await asyncio.wait_for(
+                        self.get_client().chat.completions.create(model=model, messages=messages, stream=True, **params),
+                        timeout,
+                    )
+                    return model, stream, started
+                except Exception as e:
+                    last_error = e
+                    llm_requests.observe(time.perf_counter() - started, model=model, mode="stream", outcome="error")
+                    llm_failures.inc(model=model, reason=_reason(e))
+                    if _rejected(e):
+                        raise LLMUnavailable(f"LLM request rejected: {_reason(e)}") from e
+                    if not _retryable(e) or attempt == LLM_RETRIES:
+                        break
+                    delay = backoff_delay(attempt, _retry_after(e))
+                    if time.monotonic() + delay >= deadline:
+                        break
+                    await asyncio.sleep(delay)
+        raise LLMUnavailable("all LLM models failed") from last_error
+
+    async def stream(self, messages: list[dict], **params) -> AsyncIterator[str]:
+        """
+        Куски ответа по мере генерации. Слот занят, пока поток не закрыт;
+        при закрытии генератора (клиент ушёл) поток к провайдеру закрывается.
+        """
+        deadline = time.monotonic() + LLM_TOTAL_TIMEOUT
+        await self._acquire(deadline)
+        try:
+            model, stream, started = await self._open_stream(messages, deadline, **params)
+            outcome = "error"
+            sp = span("llm", model=model, mode="stream").__enter__()
+            try:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+                outcome = "ok"
+            except (GeneratorExit, asyncio.CancelledError):
+                outcome = "cancelled"
+                raise
+            except Exception as e:
+                llm_failures.inc(model=model, reason=_reason(e))
+                raise
+            finally:
+                llm_requests.observe(time.perf_counter() - started, model=model, mode="stream", outcome=outcome)
+                sp.set(outcome=outcome)
+                sp.__exit__(None, None, None)
+                await stream.close()
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "queue_limit": self.queue_limit,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "max_queued": self.max_queued,
+            "rejected": self.rejected,
+            "hedged": self.hedged,
+        }
+
+
+llm_gateway = LLMGateway(AI_MODELS, LLM_MAX_IN_FLIGHT, LLM_QUEUE_LIMIT)
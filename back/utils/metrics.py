@@ -0,0 +1,262 @@
+"""
+Метрики процесса в текстовом формате Prometheus (GET /metrics).
+
+Свой маленький реестр вместо prometheus_client: нужны только счётчики,
+гистограммы и гауджи, которые снимаются в момент запроса (кэши, пул bcrypt).
+Метки — только из конечных множеств (шаблон пути, банк, таблица, модель),
+идентификаторы в них не попадают.
+"""
+import re
+import time
+from bisect import bisect_left
+
+# Границы корзин для задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRICS: list["_Metric"] = []
+# Функции, которые обновляют гауджи перед каждым снятием метрик
+COLLECTORS: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        METRICS.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels):
+        """Для счётчиков, которые ведутся в другом месте и снимаются коллектором"""
+        self._values[self._key(labels)] = value
+
+    def render(self):
+        lines = super().render()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def render(self):
+        lines = super().render()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}   # labels -> [counts по корзинам..., +Inf, sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = super().render()
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), series):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series[-1]!r}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    for collect in COLLECTORS:
+        try:
+            collect()
+        except Exception as e:
+            print(f"Metrics collector {collect.__name__} failed: {e!r}")
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# ---------- Метрики приложения ----------
+http_requests = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса (до конца тела ответа)",
+    ("method", "route", "status"),
+)
+bank_requests = Histogram(
+    "bank_request_duration_seconds", "Время запроса к API банка",
+    ("bank", "endpoint", "status"),
+)
+db_queries = Histogram(
+    "db_query_duration_seconds", "Время запроса к БД",
+    ("operation", "table"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+llm_requests = Histogram(
+    "llm_request_duration_seconds", "Время запроса к LLM",
+    ("model", "mode", "outcome"),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0),
+)
+llm_failures = Counter("llm_failures_total", "Неудачные запросы к LLM", ("model", "reason"))
+llm_queue_wait = Histogram(
+    "llm_queue_wait_seconds", "Ожидание свободного слота в шлюзе LLM",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+llm_gateway_gauge = Gauge("llm_gateway", "Состояние шлюза LLM (queued, in_flight, ...)", ("field",))
+llm_prompt_tokens = Histogram(
+    "llm_prompt_tokens", "Оценка размера промпта чата в токенах (по частям и всего)",
+    ("part",),
+    buckets=(25, 50, 100, 250, 500, 1000, 2000, 4000, 8000),
+)
+chat_memory_dropped = Counter("chat_memory_dropped_total", "Сообщения истории, не вошедшие в бюджет промпта")
+chat_summaries = Counter("chat_summaries_total", "Перегенерации сводки диалога", ("outcome",))
+cache_hits = Counter("cache_hits_total", "Попадания в кэш", ("cache",))
+cache_misses = Counter("cache_misses_total", "Промахи кэша", ("cache",))
+cache_hit_ratio = Gauge("cache_hit_ratio", "Доля попаданий в кэш", ("cache",))
+cache_size = Gauge("cache_entries", "Записей в кэше", ("cache",))
+sqlite_write_batch = Histogram(
+    "sqlite_write_batch_size", "Записей в одном коммите писателя SQLite", buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+sqlite_writer_gauge = Gauge("sqlite_writer", "Состояние писателя SQLite (queued, batches, writes, ...)", ("field",))
+password_pool_gauge = Gauge("password_pool", "Состояние пула bcrypt (queued, in_flight, ...)", ("field",))
+
+
+# ---------- HTTP middleware ----------
+class MetricsMiddleware:
+    """
+    ASGI-middleware: длительность и статус каждого запроса по шаблону пути.
+    Время меряется до последнего куска тела, так что стримы считаются целиком.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            http_requests.observe(
+                time.perf_counter() - started,
+                method=scope["method"], route=route, status=status["code"],
+            )
+
+
+# ---------- Банки ----------
+_ID_SEGMENT = re.compile(r"/(accounts|account-consents)/(?!request\b)[^/]+")
+
+
+def bank_endpoint(path: str) -> str:
+    """/accounts/acc-1/transactions → /accounts/{id}/transactions"""
+    return _ID_SEGMENT.sub(r"/\1/{id}", path)
+
+
+# ---------- БД ----------
+def query_table(query) -> str:
+    """Имя основной таблицы запроса SQLAlchemy (или raw для текстовых)"""
+    table = getattr(query, "table", None)
+    if table is not None and hasattr(table, "name"):
+        return table.name
+    try:
+        froms = query.get_final_froms()
+    except AttributeError:
+        return "raw"
+    return getattr(froms[0], "name", "subquery") if froms else "none"
+
+
+# ---------- Кэши ----------
+def _collect_caches():
+    from utils.cache import CACHES
+    for name, cache in CACHES.items():
+        total = cache.hits + cache.misses
+        cache_hits.set_total(cache.hits, cache=name)
+        cache_misses.set_total(cache.misses, cache=name)
+        cache_hit_ratio.set(round(cache.hits / total, 4) if total else 0.0, cache=name)
+        cache_size.set(len(cache), cache=name)
+
+
+def _collect_password_pool():
+    from utils.passwords import password_stats
+    for field, value in password_stats().items():
+        password_pool_gauge.set(value, field=field)
+
+
+def _collect_llm_gateway():
+    from utils.llm_gateway import llm_gateway
+    for field, value in llm_gateway.stats().items():
+        llm_gateway_gauge.set(value, field=field)
+
+
+def _collect_sqlite_writer():
+    from db.db import database
+    writer = getattr(database, "writer", None)
+    if writer is not None:
+        for field, value in writer.stats().items():
+            sqlite_writer_gauge.set(value, field=field)
+
+
+COLLECTORS += [_collect_caches, _collect_password_pool, _collect_llm_gateway, _collect_sqlite_writer]
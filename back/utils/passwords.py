@@ -0,0 +1,117 @@
+"""
+Хэширование паролей вне event loop.
+
+bcrypt на один вызов занимает 100–300 мс CPU; прямо в async-ручке это
+останавливает все остальные запросы воркера. Здесь хэш и проверка уходят
+в ограниченный пул потоков (bcrypt отпускает GIL, так что потоки реально
+работают параллельно), а очередь перед пулом ограничена: при шторме логинов
+лишние запросы получают 503 сразу, а не копятся бесконечно.
+"""
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+# Стоимость bcrypt; при её изменении старые хэши пересчитываются при входе (PASSWORD_REHASH)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Сколько хэшей считается одновременно
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Сколько запросов может ждать своей очереди, остальным — 503
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "256"))
+PASSWORD_REHASH = os.getenv("PASSWORD_REHASH", "1").lower() in ("1", "true", "yes", "on")
+
+pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class PasswordPool:
+    """Пул потоков под bcrypt с ограничением параллелизма и счётчиками очереди"""
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor: ThreadPoolExecutor | None = None
+        self._slots = asyncio.Semaphore(workers)
+        self.queued = 0
+        self.in_flight = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def run(self, fn, *args):
+        if self.queued >= self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Сервер перегружен, повторите вход позже",
+                headers={"Retry-After": "1"},
+            )
+
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        enqueued = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        started = time.perf_counter()
+        self.wait_seconds += started - enqueued
+
+        self.in_flight += 1
+        try:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.run_seconds += time.perf_counter() - started
+            self._slots.release()
+
+    def stats(self) -> dict:
+        done = self.completed or 1
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "max_queued": self.max_queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_seconds / done * 1000, 2),
+            "avg_run_ms": round(self.run_seconds / done * 1000, 2),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_pool = PasswordPool(PASSWORD_WORKERS, PASSWORD_QUEUE_LIMIT)
+
+
+def _verify_and_update(password: str, hashed: str) -> tuple[bool, str | None]:
+    if PASSWORD_REHASH:
+        return pwd_ctx.verify_and_update(password, hashed)
+    return pwd_ctx.verify(password, hashed), None
+
+
+async def hash_password(password: str) -> str:
+    """Хэширует пароль с использованием bcrypt"""
+    return await password_pool.run(pwd_ctx.hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> tuple[bool, str | None]:
+    """
+    Проверяет пароль. Возвращает (совпал, новый хэш) — новый хэш не None,
+    если хэш устарел (другая схема или стоимость) и его стоит сохранить.
+    """
+    return await password_pool.run(_verify_and_update, password, hashed)
+
+
+def password_stats() -> dict:
+    return password_pool.stats()
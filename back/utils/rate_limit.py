@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Простой асинхронный token bucket.
+    rate — сколько запросов в секунду пополняется, burst — ёмкость корзины.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Ждёт, пока в корзине появится токен, и забирает его"""
+        if self.rate <= 0:
+            return
+        # Под замком только бронируем токен (баланс может уйти в минус — это очередь),
+        # ждём уже без замка, чтобы один ожидающий не задерживал остальных
+        async with self._lock:
+            self._refill()
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            await asyncio.sleep(wait)
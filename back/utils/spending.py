@@ -0,0 +1,166 @@
+"""
+Материализованные агрегаты расходов пользователя.
+
+Одна строка spending_aggregates = (пользователь, банк, счёт, месяц, категория)
+с суммами расходов/доходов и числом транзакций. Строки обновляются
+инкрементально в insert_transactions — ровно на те транзакции, которые
+реально добавились, — поэтому итоги по категориям, месяцам и счетам
+считаются GROUP BY по маленькой таблице, без выгрузки истории и без банка.
+
+Из них же собирается контекст для чата в пределах бюджета токенов.
+"""
+import os
+from sqlalchemy import select, func, and_, desc
+
+from db.db import database, dialect_insert
+from db.models import spending_aggregates
+from utils.analytics import category_of
+from utils.llm import estimate_tokens
+
+# Сколько токенов контекста о расходах уходит в промпт
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "400"))
+
+_KEY = ("user_id", "bank_name", "account_id", "month", "category")
+
+
+def aggregate_key(values: dict, tx: dict) -> tuple:
+    """Ключ агрегата для строки transactions (values — как в tx_store._row_values)"""
+    booking = values.get("booking_date")
+    return (
+        values["user_id"],
+        values["bank_name"],
+        values["account_id"],
+        booking.strftime("%Y-%m") if booking else "",
+        category_of(tx),
+    )
+
+
+def accumulate(totals: dict, key: tuple, values: dict):
+    """Добавляет одну транзакцию в totals: key -> [расход, доход, количество]"""
+    entry = totals.setdefault(key, [0.0, 0.0, 0])
+    amount = values.get("amount")
+    if amount is not None:
+        if values.get("credit_debit") == "Credit":
+            entry[1] += abs(amount)
+        else:
+            entry[0] += abs(amount)
+    entry[2] += 1
+
+
+def rows_to_values(totals: dict) -> list[dict]:
+    return [
+        {**dict(zip(_KEY, key)), "spent": spent, "income": income, "tx_count": count}
+        for key, (spent, income, count) in totals.items()
+    ]
+
+
+def _upsert_query():
+    """INSERT ... ON CONFLICT DO UPDATE с прибавлением к существующим суммам"""
+    stmt = dialect_insert(spending_aggregates)
+    c = spending_aggregates.c
+    return stmt.on_conflict_do_update(
+        index_elements=[c[name] for name in _KEY],
+        set_={
+            "spent": c.spent + stmt.excluded.spent,
+            "income": c.income + stmt.excluded.income,
+            "tx_count": c.tx_count + stmt.excluded.tx_count,
+        },
+    )
+
+
+async def apply_totals(totals: dict):
+    """Прибавляет приращения к агрегатам (вызывается в той же транзакции, что и вставка)"""
+    if totals:
+        await database.execute_many(_upsert_query(), rows_to_values(totals))
+
+
+# ---------- Чтение ----------
+async def _grouped(user_id: int, bank: str | None, column):
+    c = spending_aggregates.c
+    conditions = [c.user_id == user_id]
+    if bank:
+        conditions.append(c.bank_name == bank)
+    spent = func.sum(c.spent).label("spent")
+    return await database.fetch_all(
+        select(column.label("key"), spent, func.sum(c.income).label("income"), func.sum(c.tx_count).label("count"))
+        .where(and_(*conditions))
+        .group_by(column)
+        .order_by(desc(column) if column is c.month else desc(spent))
+    )
+
+
+async def spending_totals(user_id: int, bank: str | None = None) -> dict:
+    """Итоги по категориям, месяцам (новые сверху) и счетам"""
+    c = spending_aggregates.c
+    by_category = await _grouped(user_id, bank, c.category)
+    by_month = await _grouped(user_id, bank, c.month)
+    by_account = await _grouped(user_id, bank, c.account_id)
+
+    def items(rows):
+        return [{"key": r["key"], "spent": r["spent"] or 0.0, "income": r["income"] or 0.0,
+                 "count": r["count"] or 0} for r in rows]
+
+    categories = items(by_category)
+    return {
+        "total_spent": sum(r["spent"] for r in categories),
+        "total_income": sum(r["income"] for r in categories),
+        "count": sum(r["count"] for r in categories),
+        "by_category": [r for r in categories if r["spent"] > 0],
+        "by_month": [r for r in items(by_month) if r["key"]],
+        "by_account": items(by_account),
+    }
+
+
+# ---------- Контекст для чата ----------
+def format_context(totals: dict, budget: int = CHAT_CONTEXT_TOKENS) -> str:
+    """
+    Текст о расходах не длиннее budget токенов (по оценке estimate_tokens).
+    Строки берутся из разделов по очереди — по одной за круг, самые важные
+    первыми, — так что при маленьком бюджете каждый раздел получает свои
+    верхние строки, а не один раздел съедает всё.
+    """
+    if not totals["count"]:
+        return "Данных о расходах пока нет."
+
+    total = totals["total_spent"]
+    head = (f"Всего транзакций: {totals['count']}. "
+            f"Расходы: {total:.2f} ₽, доходы: {totals['total_income']:.2f} ₽")
+    sections = [
+        ("Расходы по категориям:", [
+            f"- {r['key']}: {r['spent']:.2f} ₽ ({r['spent'] / total * 100:.1f}%)" for r in totals["by_category"]
+        ] if total else []),
+        ("По месяцам (расходы / доходы):", [
+            f"- {r['key']}: {r['spent']:.2f} / {r['income']:.2f} ₽" for r in totals["by_month"]
+        ]),
+        ("По счетам (расходы, транзакций):", [
+            f"- {r['key']}: {r['spent']:.2f} ₽, {r['count']}" for r in totals["by_account"]
+        ]),
+    ]
+
+    used = estimate_tokens(head)
+    taken = [[] for _ in sections]
+    open_sections = [i for i, (_, lines) in enumerate(sections) if lines]
+    while open_sections:
+        for i in list(open_sections):
+            title, lines = sections[i]
+            line = lines[len(taken[i])]
+            cost = estimate_tokens(line) + (0 if taken[i] else estimate_tokens(title))
+            if used + cost > budget:
+                open_sections.remove(i)
+                continue
+            used += cost
+            taken[i].append(line)
+            if len(taken[i]) == len(lines):
+                open_sections.remove(i)
+
+    parts = [head]
+    for (title, _), lines in zip(sections, taken):
+        if lines:
+            parts += [title, *lines]
+    return "\n".join(parts)
+
+
+async def chat_context(user_id: int, bank: str | None = None, budget: int = CHAT_CONTEXT_TOKENS) -> tuple[str, int]:
+    """Контекст для модели и число транзакций, по которым он собран"""
+    totals = await spending_totals(user_id, bank)
+    return format_context(totals, budget), totals["count"]
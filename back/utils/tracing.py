@@ -0,0 +1,168 @@
+"""
+Разбивка времени одного запроса по этапам.
+
+Middleware заводит на запрос RequestTrace (в contextvar), а auth, запросы к БД,
+вызовы банков и LLM записывают в него именованные спаны. Итог уходит
+в заголовок Server-Timing (виден в devtools браузера), а если запрос
+медленнее SLOW_REQUEST_MS — в лог одной JSON-строкой с деревом спанов.
+
+У потоковых ответов (SSE, NDJSON) заголовки уходят раньше, чем закончится
+тело, поэтому Server-Timing у них содержит только то, что успело произойти
+до первого байта; в лог медленных запросов попадает всё.
+"""
+import os
+import json
+import time
+from contextvars import ContextVar
+from datetime import datetime
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1").lower() in ("1", "true", "yes", "on")
+# Сколько спанов хранить на запрос (полная синхронизация — это сотни страниц)
+MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
+
+_trace: ContextVar["RequestTrace | None"] = ContextVar("request_trace", default=None)
+_parent: ContextVar[int | None] = ContextVar("trace_parent", default=None)
+
+
+class RequestTrace:
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.spans: list[dict] = []   # {"name", "start", "end", "parent", "attrs"}
+        self.dropped = 0
+
+    def elapsed_ms(self, at: float | None = None) -> float:
+        return ((at or time.perf_counter()) - self.started) * 1000
+
+    def server_timing(self) -> str:
+        """Server-Timing: суммарное время и число спанов по каждому имени + общее время"""
+        totals: dict[str, list] = {}
+        for s in self.spans:
+            if s["end"] is None:
+                continue
+            entry = totals.setdefault(s["name"], [0.0, 0])
+            entry[0] += (s["end"] - s["start"]) * 1000
+            entry[1] += 1
+        parts = [f'{name};dur={ms:.1f};desc="{count}x"' for name, (ms, count) in totals.items()]
+        parts.append(f"app;dur={self.elapsed_ms():.1f}")
+        return ", ".join(parts)
+
+    def tree(self) -> list[dict]:
+        nodes = []
+        for s in self.spans:
+            node = {
+                "name": s["name"],
+                "start_ms": round(self.elapsed_ms(s["start"]), 1),
+                "ms": round((s["end"] - s["start"]) * 1000, 1) if s["end"] else None,
+                **s["attrs"],
+                "children": [],
+            }
+            nodes.append(node)
+        roots = []
+        for s, node in zip(self.spans, nodes):
+            (nodes[s["parent"]]["children"] if s["parent"] is not None else roots).append(node)
+        for node in nodes:
+            if not node["children"]:
+                del node["children"]
+        return roots
+
+
+class span:
+    """
+    Спан текущего запроса: `with span("db", table="users"):` или `async with`.
+    Вне запроса (фоновые задачи, скрипты) ничего не делает.
+    """
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self._index = None
+        self._token = None
+        self._previous = None
+
+    def set(self, **attrs):
+        """Дописать атрибуты, известные только в конце (например, статус ответа)"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        trace = _trace.get()
+        if trace is None:
+            return self
+        if len(trace.spans) >= MAX_SPANS:
+            trace.dropped += 1
+            return self
+        self._index = len(trace.spans)
+        trace.spans.append({
+            "name": self.name, "start": time.perf_counter(), "end": None,
+            "parent": _parent.get(), "attrs": self.attrs,
+        })
+        self._previous = _parent.get()
+        self._token = _parent.set(self._index)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._index is None:
+            return False
+        trace = _trace.get()
+        if trace is not None:
+            trace.spans[self._index]["end"] = time.perf_counter()
+            if exc_type is not None:
+                self.attrs.setdefault("error", exc_type.__name__)
+        try:
+            _parent.reset(self._token)
+        except ValueError:
+            # Закрываемся из другого контекста (например, async-генератор закрыли снаружи)
+            _parent.set(self._previous)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class TracingMiddleware:
+    """ASGI-middleware: заводит RequestTrace, пишет Server-Timing и лог медленных запросов"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace = RequestTrace(scope["method"], scope["path"])
+        token = _trace.set(trace)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if SERVER_TIMING:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _trace.reset(token)
+            total = trace.elapsed_ms()
+            if total >= SLOW_REQUEST_MS:
+                route = getattr(scope.get("route"), "path", None) or scope["path"]
+                print(json.dumps({
+                    "event": "slow_request",
+                    "ts": datetime.utcnow().isoformat() + "Z",
+                    "method": trace.method,
+                    "route": route,
+                    "path": trace.path,
+                    "status": status["code"],
+                    "ms": round(total, 1),
+                    "threshold_ms": SLOW_REQUEST_MS,
+                    "dropped_spans": trace.dropped,
+                    "spans": trace.tree(),
+                }, ensure_ascii=False), flush=True)
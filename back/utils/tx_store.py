@@ -0,0 +1,211 @@
+import json
+import asyncio
+import hashlib
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import AsyncIterator
+from sqlalchemy import select, and_, or_, case, desc
+
+from db.db import database, dialect_insert
+from db.models import accounts, transactions
+from utils.answer_cache import invalidate_user_answers
+from utils import spending
+
+# Сколько транзакций вставлять одним INSERT ... VALUES (...), (...)
+_CHUNK = 500
+
+# SQLite допускает одного писателя: две параллельные транзакции синхронизации
+# сначала читают, потом пишут — и вторая сразу падает с "database is locked".
+# Поэтому на SQLite транзакции записи идут по очереди. В режиме SQLITE_TUNING
+# эту очередь уже держит сам database.transaction() (замок писателя, db/sqlite.py).
+_sqlite_write_lock = (
+    asyncio.Lock() if database.url.dialect == "sqlite" and not hasattr(database, "writer") else None
+)
+
+
+def parse_booking_date(tx: dict) -> datetime | None:
+    """Дата проводки транзакции в наивном UTC (как хранится в БД)"""
+    raw = tx.get("bookingDateTime") or tx.get("valueDateTime")
+    if not raw:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(raw).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def transaction_key(tx: dict) -> str:
+    """transactionId из банка, а если его нет — хэш содержимого"""
+    tx_id = tx.get("transactionId")
+    if tx_id:
+        return str(tx_id)
+    payload = json.dumps(tx, sort_keys=True, ensure_ascii=False)
+    return "sha1:" + hashlib.sha1(payload.encode()).hexdigest()
+
+
+def _account_filter(user_id: int, bank: str, account_id: str):
+    return and_(
+        accounts.c.user_id == user_id,
+        accounts.c.bank_name == bank,
+        accounts.c.account_id == account_id,
+    )
+
+
+def _transactions_filter(user_id: int, bank: str, account_id: str):
+    return and_(
+        transactions.c.user_id == user_id,
+        transactions.c.bank_name == bank,
+        transactions.c.account_id == account_id,
+    )
+
+
+def _row_values(user_id: int, bank: str, account_id: str, tx: dict) -> dict:
+    amount = tx.get("amount") or {}
+    try:
+        value = float(amount.get("amount"))
+    except (TypeError, ValueError):
+        value = None
+    return {
+        "user_id": user_id,
+        "bank_name": bank,
+        "account_id": account_id,
+        "transaction_id": transaction_key(tx),
+        "booking_date": parse_booking_date(tx),
+        "amount": value,
+        "currency": amount.get("currency"),
+        "credit_debit": tx.get("creditDebitIndicator"),
+        "information": tx.get("transactionInformation"),
+        "raw": json.dumps(tx, ensure_ascii=False),
+    }
+
+
+# ---------- Счета ----------
+async def get_account_state(user_id: int, bank: str, account_id: str):
+    """Строка счёта с водяным знаком синхронизации (или None)"""
+    return await database.fetch_one(
+        select(accounts).where(_account_filter(user_id, bank, account_id))
+    )
+
+
+async def save_accounts(user_id: int, bank: str, items: list[dict]):
+    """Сохраняет/обновляет JSON счетов, не трогая водяные знаки"""
+    c = accounts.c
+    for acc in items:
+        account_id = acc.get("accountId")
+        if not account_id:
+            continue
+        raw = json.dumps({k: v for k, v in acc.items() if k != "balance"}, ensure_ascii=False)
+        stmt = dialect_insert(accounts).values(user_id=user_id, bank_name=bank, account_id=account_id, raw=raw)
+        # Неизменившийся JSON не переписываем
+        await database.execute(stmt.on_conflict_do_update(
+            index_elements=[c.user_id, c.bank_name, c.account_id],
+            set_={"raw": stmt.excluded.raw},
+            where=c.raw.is_distinct_from(stmt.excluded.raw),
+        ))
+
+
+# ---------- Транзакции ----------
+async def insert_transactions(user_id: int, bank: str, account_id: str, items: list[dict]) -> tuple[int, datetime | None]:
+    """
+    Добавляет новые транзакции (уже сохранённые пропускаются) и прибавляет их
+    к агрегатам расходов; водяной знак не трогает.
+    Возвращает (число добавленных строк, самая свежая дата проводки в items).
+    """
+    rows = {}
+    aggregate_keys = {}
+    for tx in items:
+        values = _row_values(user_id, bank, account_id, tx)
+        rows[values["transaction_id"]] = values
+        aggregate_keys[values["transaction_id"]] = spending.aggregate_key(values, tx)
+    if not rows:
+        return 0, None
+
+    # Параллельная синхронизация того же счёта могла вставить часть строк раньше нас:
+    # дубликаты отсекает уникальный ключ, а RETURNING отдаёт только реально вставленные
+    keys = list(rows)
+    inserted = []
+    # Строки и агрегаты — атомарно, иначе при сбое суммы разошлись бы с историей
+    async with database.transaction():
+        for i in range(0, len(keys), _CHUNK):
+            stmt = dialect_insert(transactions).values([rows[k] for k in keys[i:i + _CHUNK]])
+            found = await database.fetch_all(
+                stmt.on_conflict_do_nothing(index_elements=[
+                    transactions.c.user_id, transactions.c.bank_name,
+                    transactions.c.account_id, transactions.c.transaction_id,
+                ]).returning(transactions.c.transaction_id)
+            )
+            inserted.extend(r["transaction_id"] for r in found)
+
+        totals = {}
+        for k in inserted:
+            spending.accumulate(totals, aggregate_keys[k], rows[k])
+        await spending.apply_totals(totals)
+
+    dates = [v["booking_date"] for v in rows.values() if v["booking_date"]]
+    return len(inserted), max(dates) if dates else None
+
+
+async def mark_synced(user_id: int, bank: str, account_id: str, newest: datetime | None):
+    """
+    Сдвигает водяной знак счёта (только вперёд) и время синхронизации.
+    Одним upsert: строку счёта могла только что создать параллельная синхронизация.
+    """
+    c = accounts.c
+    stmt = dialect_insert(accounts).values(
+        user_id=user_id,
+        bank_name=bank,
+        account_id=account_id,
+        last_booking_date=newest,
+        synced_at=datetime.utcnow(),
+    )
+    set_ = {"synced_at": stmt.excluded.synced_at}
+    if newest:
+        set_["last_booking_date"] = case(
+            (or_(c.last_booking_date.is_(None), c.last_booking_date < newest), newest),
+            else_=c.last_booking_date,
+        )
+    await database.execute(stmt.on_conflict_do_update(
+        index_elements=[c.user_id, c.bank_name, c.account_id], set_=set_,
+    ))
+
+
+def sync_lock():
+    """Замок синхронизации счёта: на обычном SQLite — общий asyncio.Lock, иначе пустой"""
+    return _sqlite_write_lock or nullcontext()
+
+
+async def save_transactions(user_id: int, bank: str, account_id: str, items: list[dict]) -> int:
+    """
+    Добавляет новые транзакции и сдвигает водяной знак счёта.
+    Возвращает число добавленных строк.
+    """
+    async with sync_lock():
+        async with database.transaction():
+            added, newest = await insert_transactions(user_id, bank, account_id, items)
+            await mark_synced(user_id, bank, account_id, newest)
+    if added:
+        invalidate_user_answers(user_id)
+    return added
+
+
+def _history_query(user_id: int, bank: str, account_id: str):
+    return (
+        select(transactions.c.raw)
+        .where(_transactions_filter(user_id, bank, account_id))
+        .order_by(desc(transactions.c.booking_date), desc(transactions.c.id))
+    )
+
+
+async def load_transactions(user_id: int, bank: str, account_id: str) -> list[dict]:
+    """Транзакции счёта из локального хранилища, новые сверху"""
+    records = await database.fetch_all(_history_query(user_id, bank, account_id))
+    return [json.loads(r["raw"]) for r in records]
+
+
+async def iterate_transactions(user_id: int, bank: str, account_id: str) -> AsyncIterator[dict]:
+    """То же, что load_transactions, но курсором — без загрузки всей истории в память"""
+    async for r in database.iterate(_history_query(user_id, bank, account_id)):
+        yield json.loads(r["raw"])
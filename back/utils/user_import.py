@@ -0,0 +1,193 @@
+"""
+Массовый импорт пользователей (сотрудники корпоративного клиента).
+
+Вместо N регистраций по одной: уникальность email/телефона/ИНН проверяется
+для всей пачки несколькими SELECT ... IN (...), пароли хэшируются параллельно
+в пуле utils.passwords, строки вставляются пачками в транзакциях.
+На выходе — отчёт по каждой строке.
+"""
+import os
+import csv
+import io
+import json
+import asyncio
+from datetime import datetime
+from pydantic import BaseModel, EmailStr, ValidationError, constr
+from sqlalchemy import select, func
+
+from db.db import database, is_unique_violation
+from db.models import users
+from utils.passwords import hash_password, password_pool
+
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "10000"))
+# Строк на один INSERT/транзакцию и значений в одном IN (...)
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "500"))
+
+
+class ImportUserSchema(BaseModel):
+    """Строка импорта: те же поля, что при регистрации, но без флагов доступа"""
+    email: EmailStr
+    password: constr(min_length=8)
+    phone: constr(min_length=11, max_length=12)
+    type_account: int  # 0 - физ. лицо, 1 - юр. лицо, 2 - ИП
+    first_name: constr(min_length=2)
+    company_name: constr(min_length=2) | None = None
+    inn: constr(min_length=10, max_length=12) | None = None
+    kpp: constr(min_length=9, max_length=9) | None = None
+
+
+# ---------- Разбор входа ----------
+def parse_csv(text: str) -> list[dict]:
+    """CSV с заголовком (email,password,phone,...); пустые ячейки → None"""
+    reader = csv.DictReader(io.StringIO(text.lstrip("\ufeff")))
+    return [{k.strip(): (v.strip() or None) for k, v in row.items() if k} for row in reader]
+
+
+def parse_json(raw: bytes) -> list[dict]:
+    """Список объектов или {"users": [...]}"""
+    data = json.loads(raw)
+    if isinstance(data, dict):
+        data = data.get("users")
+    if not isinstance(data, list) or not all(isinstance(r, dict) for r in data):
+        raise ValueError("Ожидается список пользователей")
+    return data
+
+
+def _error_text(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+
+
+def _needs_unique_inn(row: ImportUserSchema) -> bool:
+    return row.type_account in (1, 2) and bool(row.inn)
+
+
+async def _existing(column, values: set) -> set:
+    """Какие из values уже есть в users.column — по IMPORT_BATCH значений за запрос"""
+    values = list(values)
+    found = set()
+    for i in range(0, len(values), IMPORT_BATCH):
+        rows = await database.fetch_all(select(column).where(column.in_(values[i:i + IMPORT_BATCH])))
+        found.update(r[0] for r in rows)
+    return found
+
+
+async def _hash_all(passwords: list[str]) -> list[str]:
+    """
+    Хэши всех паролей через общий пул. Одновременно в очереди не больше
+    размера пула, чтобы импорт не упирался в лимит очереди и не вытеснял логины.
+    """
+    window = asyncio.Semaphore(password_pool.workers)
+
+    async def one(pw):
+        async with window:
+            return await hash_password(pw)
+
+    return await asyncio.gather(*(one(pw) for pw in passwords))
+
+
+async def _insert_batch(batch: list[tuple[dict, dict]]):
+    """Вставляет пачку в одной транзакции; при конфликте уникальности — по одной строке"""
+    try:
+        async with database.transaction():
+            await database.execute_many(users.insert(), [values for _, values in batch])
+        return
+    except Exception as e:
+        if not is_unique_violation(e):
+            raise
+
+    # Кто-то успел зарегистрироваться параллельно — выясняем, какие именно строки мешают
+    for report, values in batch:
+        try:
+            await database.execute(users.insert().values(**values))
+        except Exception as e:
+            if not is_unique_violation(e):
+                raise
+            report.update(status="error", error="Пользователь с таким email или телефоном уже существует")
+
+
+# ---------- Импорт ----------
+async def import_users(rows: list[dict]) -> dict:
+    if len(rows) > IMPORT_MAX_ROWS:
+        raise ValueError(f"Не больше {IMPORT_MAX_ROWS} строк за один импорт")
+
+    reports = [{"row": i + 1, "email": (r.get("email") if isinstance(r, dict) else None), "status": "pending"}
+               for i, r in enumerate(rows)]
+    valid: list[tuple[dict, ImportUserSchema]] = []
+
+    # 1. Схема и дубликаты внутри самого файла
+    seen_email, seen_phone, seen_inn = set(), set(), set()
+    for report, raw in zip(reports, rows):
+        try:
+            row = ImportUserSchema.model_validate(raw)
+        except ValidationError as e:
+            report.update(status="error", error=_error_text(e))
+            continue
+        report["email"] = row.email
+        email = row.email.lower()
+        if email in seen_email:
+            report.update(status="error", error="Email повторяется в файле")
+        elif row.phone in seen_phone:
+            report.update(status="error", error="Телефон повторяется в файле")
+        elif _needs_unique_inn(row) and row.inn in seen_inn:
+            report.update(status="error", error="ИНН повторяется в файле")
+        else:
+            seen_email.add(email)
+            seen_phone.add(row.phone)
+            if _needs_unique_inn(row):
+                seen_inn.add(row.inn)
+            valid.append((report, row))
+
+    # 2. Уникальность относительно БД — по одному set-запросу на поле
+    taken_email = await _existing(func.lower(users.c.email), {row.email.lower() for _, row in valid})
+    taken_phone = await _existing(users.c.phone, {row.phone for _, row in valid})
+    taken_inn = await _existing(users.c.inn, {row.inn for _, row in valid if _needs_unique_inn(row)})
+
+    accepted = []
+    for report, row in valid:
+        if row.email.lower() in taken_email:
+            report.update(status="error", error="Пользователь с таким email уже существует")
+        elif row.phone in taken_phone:
+            report.update(status="error", error="Пользователь с таким телефоном уже существует")
+        elif _needs_unique_inn(row) and row.inn in taken_inn:
+            report.update(status="error", error="Компания с таким ИНН уже зарегистрирована")
+        else:
+            accepted.append((report, row))
+
+    # 3. Хэши параллельно в пуле
+    hashes = await _hash_all([row.password for _, row in accepted])
+
+    # 4. Вставка пачками
+    now = datetime.utcnow()
+    prepared = [
+        (report, {
+            **row.model_dump(exclude={"password"}),
+            "password_hash": hashed,
+            "premium": False,
+            "is_admin": False,
+            "is_blocked": False,
+            "created_at": now,
+            "last_login": None,
+        })
+        for (report, row), hashed in zip(accepted, hashes)
+    ]
+    for i in range(0, len(prepared), IMPORT_BATCH):
+        await _insert_batch(prepared[i:i + IMPORT_BATCH])
+
+    # 5. id созданных пользователей
+    created = [report for report, _ in prepared if report["status"] == "pending"]
+    emails = [values["email"] for report, values in prepared if report["status"] == "pending"]
+    ids = {}
+    for i in range(0, len(emails), IMPORT_BATCH):
+        found = await database.fetch_all(
+            select(users.c.id, users.c.email).where(users.c.email.in_(emails[i:i + IMPORT_BATCH]))
+        )
+        ids.update((r["email"], r["id"]) for r in found)
+    for report in created:
+        report.update(status="created", id=ids.get(report["email"]))
+
+    return {
+        "total": len(reports),
+        "created": len(created),
+        "failed": len(reports) - len(created),
+        "rows": reports,
+    }